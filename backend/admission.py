@@ -0,0 +1,148 @@
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Dict
+
+from fastapi import HTTPException
+import logging
+logger = logging.getLogger("uvicorn.error")
+
+
+# -----------------------------------------------------
+#  COST MODEL
+# -----------------------------------------------------
+# One "cost unit" is roughly the work of opening and copying one plain page.
+# Raster crop (remove_white) renders + JPEG encodes every page, so it is
+# weighted much higher than the text based filters.
+PAGE_COST = 1.0
+MB_COST = 2.0
+FILTER_PAGE_COST: Dict[str, float] = {
+    "remove_white": 6.0,
+    "print_datetime": 0.5,
+    "sort_courier": 0.5,
+    "bottom_of_the_table": 0.5,
+}
+
+
+def estimate_request_cost(page_count: int, total_bytes: int, filter: dict) -> float:
+    """
+    Estimate the cost of a /crop-pdf request from page count, upload size
+    and the enabled filters.
+    """
+    per_page = PAGE_COST
+    for name, weight in FILTER_PAGE_COST.items():
+        if filter.get(name):
+            per_page += weight
+
+    return page_count * per_page + (total_bytes / (1024 * 1024)) * MB_COST
+
+
+# -----------------------------------------------------
+#  ADMISSION CONTROLLER
+# -----------------------------------------------------
+class AdmissionController:
+    """
+    Global cost budget shared by all concurrent requests of this worker.
+
+    Requests are admitted in arrival order (FIFO): a request runs when it is
+    first in line and its cost fits in the free budget, so a small request
+    never overtakes a large one that is already waiting. Requests that can
+    never fit (cost > budget) or whose estimated wait is longer than
+    `max_wait` seconds are rejected instead of queued.
+    """
+
+    def __init__(self, budget: float, max_wait: float, initial_rate: float = 200.0):
+        self.budget = budget
+        self.max_wait = max_wait
+        self.in_use = 0.0
+        self.queued = 0.0
+        self._waiters: deque = deque()  # one ticket per waiting request, in arrival order
+        # observed throughput in cost units / second (EWMA), used for wait estimates
+        self.rate = initial_rate
+        self._cond = asyncio.Condition()
+
+    def estimated_wait(self, cost: float) -> float:
+        # FIFO: everything queued starts before this request
+        excess = self.in_use + self.queued + cost - self.budget
+        if excess <= 0:
+            return 0.0
+        return excess / self.rate
+
+    def _observe(self, cost: float, elapsed: float):
+        if elapsed <= 0 or cost <= 0:
+            return
+        self.rate = 0.8 * self.rate + 0.2 * (cost / elapsed)
+
+    def check_fits(self, cost: float):
+        """Reject (413) a cost that could never fit in the budget."""
+        if cost > self.budget:
+            raise HTTPException(
+                status_code=413,
+                detail=f"Request too large: estimated cost {cost:.0f} exceeds budget {self.budget:.0f}. "
+                       f"Split the upload into smaller files.",
+            )
+
+    @asynccontextmanager
+    async def reserve(self, cost: float):
+        """
+        Hold `cost` units of the budget for the duration of the block.
+        Yields a dict with the estimated and the actual queue wait.
+        """
+        self.check_fits(cost)
+
+        estimated = self.estimated_wait(cost)
+        if estimated > self.max_wait:
+            raise HTTPException(
+                status_code=503,
+                detail=f"Server busy, estimated wait {estimated:.0f}s",
+                headers={"Retry-After": str(math.ceil(estimated))},
+            )
+
+        queued_at = time.monotonic()
+        waiter = object()
+        try:
+            async with self._cond:
+                self._waiters.append(waiter)
+                self.queued += cost
+                try:
+                    await asyncio.wait_for(
+                        self._cond.wait_for(
+                            lambda: self._waiters[0] is waiter and self.in_use + cost <= self.budget
+                        ),
+                        timeout=self.max_wait,
+                    )
+                    self.in_use += cost
+                finally:
+                    # admitted or given up: the next in line may fit now
+                    self._waiters.remove(waiter)
+                    self.queued -= cost
+                    self._cond.notify_all()
+        except asyncio.TimeoutError:
+            retry = self.estimated_wait(cost)
+            raise HTTPException(
+                status_code=503,
+                detail=f"Server busy, estimated wait {retry:.0f}s",
+                headers={"Retry-After": str(max(1, math.ceil(retry)))},
+            )
+
+        started_at = time.monotonic()
+        ticket = {"cost": cost, "estimated_wait": estimated, "wait": started_at - queued_at}
+        if ticket["wait"] > 0.05:
+            logger.info(f"Admission: waited {ticket['wait']:.2f}s for {cost:.0f} units")
+
+        try:
+            yield ticket
+        finally:
+            self._observe(cost, time.monotonic() - started_at)
+            async with self._cond:
+                self.in_use -= cost
+                self._cond.notify_all()
+
+
+admission = AdmissionController(
+    budget=float(os.getenv("CROP_PDF_BUDGET", "30000")),
+    max_wait=float(os.getenv("CROP_PDF_MAX_WAIT", "120")),
+)
@@ -0,0 +1,90 @@
+from io import BytesIO
+import zipfile
+
+import fitz
+
+from backend.pdf_process import process_pdf, merge_and_order_id_zip
+from backend.page_index import page_index, content_key
+import logging
+logger = logging.getLogger("uvicorn.error")
+
+
+# Job functions take and return plain picklable values (bytes, dicts), so the
+# same job can run in a web worker thread or in a processing pool process.
+
+def zip_result(entries, report, filename="processed_files.zip"):
+    zip_buffer = BytesIO()
+    with zipfile.ZipFile(zip_buffer, "w") as zip_file:
+        for name, data in entries:
+            zip_file.writestr(name, data)
+
+    return {
+        "body": zip_buffer.getvalue(),
+        "media_type": "application/zip",
+        "filename": filename,
+        "report": report,
+    }
+
+
+def process_single_file(file_bytes, filter):
+    """No-merge job for one upload: (processed PDF bytes, report)."""
+    report = {}
+    processed_doc = process_pdf(file_bytes, filter, report)
+    return processed_doc.tobytes(), report
+
+
+def run_crop_job(input_pdf, merge, separate_order_list, filter):
+    """
+    CPU part of /crop-pdf. Takes [{"bytes", "filename"}] and returns a result
+    dict (body / media_type / filename / report), so it can run in a worker
+    thread or in a pool process.
+    """
+    report = {}
+
+    if merge and separate_order_list:
+        logger.info("Merging PDFs with separate order IDs and filter...")
+        zip_bytes = merge_and_order_id_zip(input_pdf, separate_order_list, filter, report)
+        if zip_bytes is None:
+            return None
+        return {
+            "body": zip_bytes,
+            "media_type": "application/zip",
+            "filename": "orders_output.zip",
+            "report": report,
+        }
+
+    if merge:
+        logger.info("Condition 2: merge only + apply filters")
+        merged_doc = fitz.open()
+
+        # Merge PDF pages into single doc
+        for item in input_pdf:
+            temp_doc = fitz.open(stream=item["bytes"], filetype="pdf")
+            merged_doc.insert_pdf(temp_doc)
+
+        merged_bytes = merged_doc.tobytes()
+        if filter.get("sort_courier") and page_index is not None:
+            # indexed uploads -> index of the merged document
+            page_index.put_combined(
+                [content_key(item["bytes"]) for item in input_pdf], content_key(merged_bytes)
+            )
+
+        # Now run filters on ONE document
+        processed_doc = process_pdf(merged_bytes, filter, report)
+        return {
+            "body": processed_doc.tobytes(),
+            "media_type": "application/pdf",
+            "filename": f"{input_pdf[0]['filename']}_merged.pdf",
+            "report": report,
+        }
+            
+    # """ If merge is False & and User pass multiple PDFs then apply process_pdf() on each PDF and return zip of all processed PDFs"""
+    logger.info("Condition 3: no merge → process each file individually")
+
+    entries = []
+    for item in input_pdf:
+        processed_bytes, file_report = process_single_file(item["bytes"], filter)
+        report.setdefault("duplicates", []).extend(file_report.get("duplicates", []))
+        entries.append((item["filename"], processed_bytes))
+
+    return zip_result(entries, report)
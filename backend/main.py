@@ -2,25 +2,48 @@
 
 from operator import le
 import os
-from fastapi import FastAPI , File, UploadFile,Form,Query,HTTPException 
-from fastapi.responses import FileResponse, StreamingResponse
+from fastapi import FastAPI , File, UploadFile,Form,Query,HTTPException, Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from typing import Annotated, List, Optional
-from backend.pdf_process import process_pdf
-from io import BytesIO
 import fitz  # PyMuPDF
-import zipfile
 import datetime
 import base64
 from backend.utils import *
 import logging
-from backend.pdf_process import merge_and_order_id
+from backend.pdf_process import SPLIT_OUTPUTS
 logger = logging.getLogger("uvicorn.error")
 logger.setLevel(logging.INFO)
 from fastapi.staticfiles import StaticFiles
+from starlette.concurrency import run_in_threadpool
+from backend.admission import admission, estimate_request_cost
+from backend.streaming import iter_multipart
+from backend.pipeline import STREAM_SPOOL_BYTES, ZIP_CHUNK_SIZE, iter_uploads, zip_pipeline
+from backend.result_store import result_store, result_key
+from backend.workers import run_job, start_pool, stop_pool
+from backend.jobs import run_crop_job, process_single_file, zip_result
+from backend.profiling import RequestProfiler, is_admin, profile_path
+from backend.page_index import (
+    page_index, content_key, iter_page_index, summarize_index, sort_meta_from_index,
+)
+import hashlib
+import json
+import tempfile
+import time
+from urllib.parse import quote
+from contextlib import asynccontextmanager
+import asyncio
 import os
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app):
+    # start (and warm up) the processing workers before the first request
+    await run_in_threadpool(start_pool)
+    yield
+    stop_pool()
+
+
+app = FastAPI(lifespan=lifespan)
 
 
 
@@ -33,8 +56,198 @@ app.add_middleware(
 )
 
 
+def _report_headers(report):
+    headers = {}
+    duplicates = report.get("duplicates", [])
+    headers["X-Duplicates-Removed"] = str(len(duplicates))
+    # order numbers come from the PDF text: percent-encoded, since header
+    # values must be latin-1; pages without one are only counted
+    orders = sorted({quote(d["order_no"], safe="") for d in duplicates if d["order_no"]})
+    if orders:
+        value = ""
+        for order in orders:
+            if len(value) + len(order) + 1 > 1000:
+                break
+            value = f"{value},{order}" if value else order
+        headers["X-Duplicate-Orders"] = value
+    return headers
+
+
+def _result_response(result):
+    """Response for a job result dict (body / media_type / filename / report)."""
+    headers = {"Content-Disposition": f"attachment; filename={result['filename']}"}
+    headers.update(_report_headers(result["report"]))
+    return Response(content=result["body"], media_type=result["media_type"], headers=headers)
+
+
+def _request_result_key(file_hashes, filenames, merge, separate_order_list, filter):
+    """Result store id of a request, from the content_key() of each upload and the options."""
+    if result_store is None:
+        return None
+    return result_key(
+        file_hashes,
+        {
+            "filenames": filenames,
+            "merge": merge,
+            "separate_order_list": separate_order_list if merge else "",
+            "filter": filter,
+        },
+    )
+
+
+async def _upload_content_key(file: UploadFile, chunk_size: int = 1024 * 1024) -> str:
+    """content_key() of an UploadFile, read in chunks and rewound."""
+    h = hashlib.sha256()
+    while chunk := await file.read(chunk_size):
+        h.update(chunk)
+    await file.seek(0)
+    return h.hexdigest()
+
+
+def _reuses_stored_result(filter) -> bool:
+    """
+    A re-POST may be answered from the result store unless the output
+    carries the print time; those results are only served by /results/{id}.
+    """
+    return not filter.get("print_datetime")
+
+
+def _result_headers(meta):
+    headers = {"X-Result-Id": meta["id"], "X-Result-Url": f"/results/{meta['id']}"}
+    if "etag" in meta:
+        headers["ETag"] = meta["etag"]
+    return headers
+
+
+def _stored_response(meta, request: Request):
+    """
+    Stored result as a file response: Range / If-Range are handled by
+    FileResponse, If-None-Match against the content ETag here.
+    """
+    headers = dict(meta["headers"])
+    headers.update(_result_headers(meta))
+    headers["Cache-Control"] = f"private, max-age={max(0, int(meta['expires'] - time.time()))}"
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        tags = [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+        if "*" in tags or meta["etag"] in tags:
+            return Response(status_code=304, headers=headers)
+
+    return FileResponse(
+        meta["path"],
+        media_type=meta["media_type"],
+        filename=meta["filename"],
+        headers=headers,
+    )
+
+
+async def _store_result(key, result, response):
+    """Keep a finished result for re-downloads and add its X-Result-* headers."""
+    if key is None or result_store is None:
+        return
+    meta = await run_in_threadpool(
+        result_store.put, key, result["body"], result["media_type"], result["filename"],
+        _report_headers(result["report"]),
+    )
+    if meta is not None:
+        response.headers.update(_result_headers(meta))
+
+
+# Boolean form fields that end up in the `filter` dict
+FILTER_FIELDS = [
+    "remove_white",
+    "print_datetime",
+    "bottom_of_the_table",
+    "keep_invoice_no_crop",
+    "sort_courier",
+    "remove_duplicates",
+    "split_per_order",
+]
+
+
+def _form_bool(value) -> bool:
+    return str(value).strip().lower() in ("1", "true", "on", "yes")
+
+
+def _labels_per_sheet(value) -> int:
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        value = 0
+    if value not in IMPOSITION_GRIDS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"labels_per_sheet must be one of {sorted(IMPOSITION_GRIDS)}",
+        )
+    return value
+
+
+def _split_outputs(value):
+    """
+    "selected,cleaned,per_order" subset for the order split, None when not
+    given (the split then uses its defaults).
+    """
+    names = [v.strip() for v in str(value or "").replace(",", " ").split()]
+    if not names:
+        return None
+    unknown = [n for n in names if n not in SPLIT_OUTPUTS]
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown outputs {unknown}, expected any of {list(SPLIT_OUTPUTS)}",
+        )
+    return sorted(set(names))
+
+
+async def run_admitted_crop_job(input_pdf, merge, separate_order_list, filter, profiler=None,
+                                result_key=None):
+    """
+    Count pages, wait for admission, then run run_crop_job on a worker.
+    A profiled job runs in this process' threadpool so its stages and samples
+    are recorded here. With `result_key` the output is kept in the result store.
+    """
+    total_pages = 0
+    total_bytes = 0
+    for item in input_pdf:
+        if item.get("doc") is None:
+            item["doc"] = fitz.open(stream=item["bytes"], filetype="pdf")
+        total_pages += len(item["doc"])
+        total_bytes += len(item["bytes"])
+
+    # Admission control: wait for (or reject on) the shared cost budget
+    cost = estimate_request_cost(total_pages, total_bytes, filter)
+    logger.info(f"Estimated cost: {cost:.0f} units for {total_pages} pages")
+
+    # open documents stay here, workers get plain bytes
+    job_input = [{"bytes": item["bytes"], "filename": item["filename"]} for item in input_pdf]
+
+    async with admission.reserve(cost) as ticket:
+        if profiler is None:
+            result = await run_job(run_crop_job, job_input, merge, separate_order_list, filter)
+        else:
+            result = await run_in_threadpool(
+                profiler.run, run_crop_job, job_input, merge, separate_order_list, filter
+            )
+
+    if profiler is not None:
+        await run_in_threadpool(profiler.save)
+
+    if result is None:
+        return None
+    response = _result_response(result)
+    response.headers["X-Admission-Cost"] = f"{cost:.0f}"
+    response.headers["X-Admission-Wait"] = f"{ticket['wait']:.2f}"
+    if profiler is not None:
+        response.headers["X-Profile-Id"] = profiler.id
+        response.headers["X-Profile-Url"] = f"/crop-pdf/profile/{profiler.id}"
+    await _store_result(result_key, result, response)
+    return response
+
+
 @app.post("/crop-pdf")
 async def crop_pdf_editor(
+    request: Request,
     files: list[UploadFile] = File(...),
     merge: bool = Form(False),
     # sort_by_sold: bool = Form(False),
@@ -45,7 +258,18 @@ async def crop_pdf_editor(
     keep_invoice_no_crop: bool = Form(False),
     bottom_of_the_table:bool=Form(False),
     separate_order_list: str = Form(""),
+    remove_duplicates: bool = Form(False),
+    split_per_order: bool = Form(False),
+    labels_per_sheet: int = Form(1),
+    outputs: str = Form(""),
+    profile: bool = Form(False),
 ):
+    profiler = None
+    if profile or _form_bool(request.headers.get("X-Profile", "")):
+        if not is_admin(request.headers.get("X-Admin-Token")):
+            raise HTTPException(status_code=403, detail="Profiling requires a valid X-Admin-Token")
+        profiler = RequestProfiler()
+
     try:
         filter = {
             "remove_white": remove_white,
@@ -53,8 +277,28 @@ async def crop_pdf_editor(
             "bottom_of_the_table":bottom_of_the_table,
             "keep_invoice_no_crop": keep_invoice_no_crop,
             "sort_courier": sort_courier,
+            "remove_duplicates": remove_duplicates,
+            "split_per_order": split_per_order,
+            "labels_per_sheet": _labels_per_sheet(labels_per_sheet),
+            "outputs": _split_outputs(outputs),
         }
         logger.info(f"Filter settings: {filter}")
+
+        # same files + options as a stored result: serve it, no reprocessing
+        key = None
+        if result_store is not None and profiler is None:
+            file_hashes = [await _upload_content_key(file) for file in files]
+            filenames = [file.filename or f"input_{index+1}.pdf" for index, file in enumerate(files)]
+            key = _request_result_key(file_hashes, filenames, merge, separate_order_list, filter)
+            meta = result_store.get(key) if _reuses_stored_result(filter) else None
+            if meta is not None:
+                logger.info(f"Serving stored result {key}")
+                return _stored_response(meta, request)
+
+        if not merge and profiler is None:
+            # per-file outputs: read, process and write the ZIP as a pipeline
+            return await _pipelined_zip_response(files, filter, key)
+
         logger.info("Reading all PDFs into memory...")
         logger.info(f"Bottom of the table filter: {filter['remove_white']}")
 
@@ -69,50 +313,350 @@ async def crop_pdf_editor(
             })
         logger.info(f"Total PDFs received: {len(input_pdf)}")
 
-        if merge and separate_order_list:
-            logger.info("Merging PDFs with separate order IDs and filter...")
-            result = merge_and_order_id(input_pdf, separate_order_list, filter)
-            return result        
+        return await run_admitted_crop_job(
+            input_pdf, merge, separate_order_list, filter, profiler, result_key=key
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error processing PDFs: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+async def _pipelined_zip_response(files, filter, key=None):
+    """
+    ZIP of per-file outputs, streamed while later files are still being read
+    and processed. Headers go out with the first file, so the duplicate
+    report is written into the ZIP instead of X-Duplicate-* headers. With
+    `key` the streamed bytes are also written to the result store and the
+    result is published once the ZIP is complete.
+    """
+    # open and page-count every upload before anything is sent, so a corrupt
+    # or oversized file is still a normal error response
+    for index, file in enumerate(files):
+        file_bytes = await file.read()
+        await file.seek(0)
+        try:
+            with fitz.open(stream=file_bytes, filetype="pdf") as doc:
+                page_count = len(doc)
+        except Exception as e:
+            name = file.filename or f"input_{index+1}.pdf"
+            logger.error(f"Error opening {name}: {e}")
+            raise HTTPException(status_code=500, detail=f"{name}: {e}")
+        admission.check_fits(estimate_request_cost(page_count, len(file_bytes), filter))
+        del file_bytes
+
+    async def process(file_bytes):
+        processed_bytes, report, _, _ = await _process_streamed_file(file_bytes, filter)
+        return processed_bytes, report
+
+    report_name = "duplicates_report.json" if filter.get("remove_duplicates") else None
+    errors = []
+    body = zip_pipeline(iter_uploads(files), process, report_name=report_name, errors=errors)
+
+    # wait for the first file, so admission / processing errors on it are
+    # still returned as a normal error response
+    first = await body.__anext__()
+
+    filename = "processed_files.zip"
+    headers = {"Content-Disposition": f"attachment; filename={filename}"}
+    writer = None
+    if key is not None:
+        try:
+            writer = result_store.writer(key, "application/zip", filename)
+            headers.update(_result_headers({"id": key}))
+        except OSError as e:
+            logger.warning(f"Result store write failed: {e}")
+
+    def tee(chunk):
+        if writer is not None:
+            writer.write(chunk)
+        return chunk
+
+    async def chunks():
+        complete = False
+        try:
+            yield tee(first)
+            async for chunk in body:
+                yield tee(chunk)
+            complete = True
+        finally:
+            # never publish a partial ZIP (dropped connection) or one with
+            # error entries
+            if writer is not None and complete and not errors:
+                try:
+                    writer.commit()
+                except OSError as e:
+                    logger.warning(f"Result store write failed: {e}")
+                    writer.abort()
+            elif writer is not None:
+                writer.abort()
+
+    return StreamingResponse(chunks(), media_type="application/zip", headers=headers)
+
+
+@app.api_route("/results/{result_id}", methods=["GET", "HEAD"])
+async def get_result(result_id: str, request: Request):
+    """
+    Re-download a finished output by its X-Result-Id. Supports Range /
+    If-Range (resume) and If-None-Match (ETag); results expire after
+    RESULT_STORE_TTL seconds.
+    """
+    meta = result_store.get(result_id) if result_store is not None else None
+    if meta is None:
+        raise HTTPException(status_code=404, detail="Result not found or expired")
+    return _stored_response(meta, request)
+
+
+@app.get("/crop-pdf/profile/{profile_id}")
+async def crop_pdf_profile(profile_id: str, request: Request):
+    """Download a saved profile: summary.json, stages.json, profile.folded."""
+    if not is_admin(request.headers.get("X-Admin-Token")):
+        raise HTTPException(status_code=403, detail="Invalid X-Admin-Token")
+    path = profile_path(profile_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, media_type="application/zip", filename=f"profile_{profile_id}.zip")
+
+
+# pages extracted per threadpool call by /crop-pdf/index
+INDEX_CHUNK_PAGES = 50
+
+
+def _ndjson(record) -> bytes:
+    return (json.dumps(record) + "\n").encode()
+
+
+@app.post("/crop-pdf/index")
+async def crop_pdf_index(files: list[UploadFile] = File(...)):
+    """
+    Text-only pre-scan of the uploads, streamed as NDJSON while it runs:
+
+        {"type": "file", "file", "pages", "content_hash", "cached"}
+        {"type": "page", "file", "page", "courier", "qty", "order_no"}   (per page)
+        {"type": "file_summary", "file", "pages", "couriers", "total_qty", ..., "courier_order"}
+        {"type": "summary", ...}                                          (all files)
+        {"type": "error", "file", "status", "detail"}    (file not indexed, e.g. server busy)
+
+    Indexes are cached by content hash, a following /crop-pdf with
+    sort_courier on the same files reuses them instead of re-extracting.
+    Files are opened and indexed one at a time, each under an admission
+    reservation for its text-only cost.
+    """
+    # open and page-count each upload (one at a time) before anything is
+    # sent, so an unreadable or oversized file is still a normal error
+    uploads = []
+    for file in files:
+        filename = file.filename or f"input_{len(uploads)+1}.pdf"
+        data = await file.read()
+        await file.seek(0)
+        try:
+            with fitz.open(stream=data, filetype="pdf") as doc:
+                page_count = len(doc)
+        except Exception:
+            raise HTTPException(status_code=400, detail=f"{file.filename} is not a readable PDF")
+        # text only: no filter work on top of opening the pages
+        cost = estimate_request_cost(page_count, len(data), {})
+        admission.check_fits(cost)
+        uploads.append((file, filename, content_key(data), page_count, cost))
+        del data
+
+    async def records():
+        all_pages = []
+        for file, filename, key, page_count, cost in uploads:
+            pages = page_index.get(key) if page_index is not None else None
+            yield _ndjson({"type": "file", "file": filename, "pages": page_count,
+                           "content_hash": key, "cached": pages is not None})
+
+            if pages is None:
+                pages = []
+                try:
+                    async with admission.reserve(cost):
+                        doc = fitz.open(stream=await file.read(), filetype="pdf")
+                        try:
+                            for start in range(0, len(doc), INDEX_CHUNK_PAGES):
+                                chunk = await run_in_threadpool(
+                                    list, iter_page_index(doc, start, start + INDEX_CHUNK_PAGES)
+                                )
+                                for entry in chunk:
+                                    yield _ndjson({"type": "page", "file": filename, **entry})
+                                pages.extend(chunk)
+                        finally:
+                            doc.close()
+                except HTTPException as e:
+                    # the status line is already sent: report the file as not indexed
+                    yield _ndjson({"type": "error", "file": filename,
+                                   "status": e.status_code, "detail": e.detail})
+                    continue
+                if page_index is not None:
+                    await run_in_threadpool(page_index.put, key, pages)
+            else:
+                for entry in pages:
+                    yield _ndjson({"type": "page", "file": filename, **entry})
+
+            all_pages.extend(pages)
+            yield _ndjson({
+                "type": "file_summary",
+                "file": filename,
+                **summarize_index(pages),
+                "courier_order": courier_sort_order(sort_meta_from_index(pages)),
+            })
+
+        yield _ndjson({"type": "summary", "files": len(uploads), **summarize_index(all_pages)})
+
+    return StreamingResponse(records(), media_type="application/x-ndjson")
+
+
+async def _process_streamed_file(file_bytes, filter):
+    doc = fitz.open(stream=file_bytes, filetype="pdf")
+    cost = estimate_request_cost(len(doc), len(file_bytes), filter)
+    async with admission.reserve(cost) as ticket:
+        processed_bytes, report = await run_job(process_single_file, file_bytes, filter)
+    return processed_bytes, report, cost, ticket["wait"]
+
+
+@app.post("/crop-pdf/stream")
+async def crop_pdf_stream(request: Request):
+    """
+    Same form fields and outputs as /crop-pdf, but the body is parsed while it
+    is still uploading. Without merge, the files go through the same
+    read -> process -> write pipeline as /crop-pdf (zip_pipeline): each file
+    is processed as soon as it has fully arrived, later uploads overlap with
+    the work on earlier ones, and the body is only read further when an
+    in-flight slot is free. The ZIP is spooled to a temp file and sent once
+    the upload is complete. All form fields must be sent before the first file.
+
+    The result id is only known once the whole body has arrived, when the
+    per-file work is already running, so only merge requests (which start no
+    work before that) are answered from the result store. Results are still
+    stored for /results/{id}.
+    """
+    fields = {}
+    parts = iter_multipart(request)
+    try:
+        first = None
+        async for part in parts:
+            if part[0] == "file":
+                first = part
+                break
+            fields[part[1]] = part[2]
+        if first is None:
+            raise HTTPException(status_code=400, detail="No files uploaded")
+
+        filter = {name: _form_bool(fields.get(name, "")) for name in FILTER_FIELDS}
+        filter["labels_per_sheet"] = _labels_per_sheet(fields.get("labels_per_sheet", 1))
+        filter["outputs"] = _split_outputs(fields.get("outputs"))
+        merge = _form_bool(fields.get("merge", ""))
+        separate_order_list = fields.get("separate_order_list", "")
+        logger.info(f"Filter settings: {filter}")
+
+        file_hashes = []
+        filenames = []
+
+        async def uploads():
+            """(filename, bytes) of the first file part and every later one."""
+            part = first
+            while True:
+                _, _, filename, file_bytes = part
+                filename = filename or f"input_{len(filenames)+1}.pdf"
+                file_hashes.append(content_key(file_bytes))
+                filenames.append(filename)
+                yield filename, file_bytes
+                part = await anext(parts, None)
+                if part is None:
+                    return
+                if part[0] == "field":
+                    raise HTTPException(
+                        status_code=400,
+                        detail=f"Field '{part[1]}' sent after files; send all form fields before the files",
+                    )
 
         if merge:
-            logger.info("Condition 2: merge only + apply filters")
-            merged_doc = fitz.open()
-
-            # Merge PDF pages into single doc
-            for item in input_pdf:
-                temp_doc = fitz.open(stream=item["bytes"], filetype="pdf")
-                merged_doc.insert_pdf(temp_doc)
-
-            # Now run filters on ONE document
-            processed_doc = process_pdf(merged_doc.tobytes(), filter)
-            return StreamingResponse(
-                BytesIO(processed_doc.tobytes()),
-                media_type="application/pdf",
-                headers={"Content-Disposition": f"attachment; filename={input_pdf[0]['filename']}_merged.pdf"}
+            input_pdf = [{"bytes": data, "filename": name} async for name, data in uploads()]
+            logger.info(f"Total PDFs received: {len(input_pdf)}")
+            key = _request_result_key(file_hashes, filenames, merge, separate_order_list, filter)
+            meta = result_store.get(key) if key is not None and _reuses_stored_result(filter) else None
+            if meta is not None:
+                logger.info(f"Serving stored result {key}")
+                return _stored_response(meta, request)
+            return await run_admitted_crop_job(
+                input_pdf, merge, separate_order_list, filter, result_key=key
             )
-                
-        # """ If merge is False & and User pass multiple PDFs then apply process_pdf() on each PDF and return zip of all processed PDFs"""
-        logger.info("Condition 3: no merge → process each file individually")
-
-        zip_buffer = BytesIO()
-        with zipfile.ZipFile(zip_buffer, "w") as zip_file:
-            for idx, item in enumerate(input_pdf):
-                processed_doc = process_pdf(item["bytes"], filter)
-                processed_bytes = processed_doc.tobytes()
-                zip_file.writestr(f"{input_pdf[idx]['filename']}", processed_bytes)
-
-        zip_buffer.seek(0)
-
-        return StreamingResponse(
-            zip_buffer,
-            media_type="application/zip",
-            headers={"Content-Disposition": f"attachment; filename=processed_files.zip"}
-        )
+
+        report = {}
+        costs = []
+        waits = []
+
+        async def process(file_bytes):
+            processed_bytes, file_report, cost, wait = await _process_streamed_file(file_bytes, filter)
+            report.setdefault("duplicates", []).extend(file_report.get("duplicates", []))
+            costs.append(cost)
+            waits.append(wait)
+            return processed_bytes, {}
+
+        # nothing is sent before the upload is complete, so any failure is
+        # still a normal error response
+        errors = []
+        spool = tempfile.SpooledTemporaryFile(max_size=STREAM_SPOOL_BYTES)
+        try:
+            async for chunk in zip_pipeline(uploads(), process, errors=errors):
+                spool.write(chunk)
+        except BaseException:
+            spool.close()
+            raise
+        if errors:
+            spool.close()
+            filename, error = errors[0]
+            if isinstance(error, HTTPException):
+                raise error
+            raise HTTPException(status_code=500, detail=f"{filename}: {error}")
+        logger.info(f"Total PDFs received: {len(filenames)}")
+
+        key = _request_result_key(file_hashes, filenames, merge, separate_order_list, filter)
+        filename = "processed_files.zip"
+        headers = {"Content-Disposition": f"attachment; filename={filename}"}
+        headers.update(_report_headers(report))
+        headers["X-Admission-Cost"] = f"{sum(costs):.0f}"
+        headers["X-Admission-Wait"] = f"{max(waits):.2f}"
+        if key is not None:
+            spool.seek(0)
+            meta = await run_in_threadpool(_store_spooled_result, key, spool, filename, _report_headers(report))
+            if meta is not None:
+                headers.update(_result_headers(meta))
+
+        async def body():
+            try:
+                spool.seek(0)
+                while chunk := await run_in_threadpool(spool.read, ZIP_CHUNK_SIZE):
+                    yield chunk
+            finally:
+                spool.close()
+
+        return StreamingResponse(body(), media_type="application/zip", headers=headers)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error processing PDFs: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def _store_spooled_result(key, spool, filename, headers):
+    """Copy a spooled ZIP into the result store; its metadata, or None."""
+    try:
+        writer = result_store.writer(key, "application/zip", filename, headers)
+    except OSError as e:
+        logger.warning(f"Result store write failed: {e}")
+        return None
+    try:
+        while chunk := spool.read(ZIP_CHUNK_SIZE):
+            writer.write(chunk)
+        return writer.commit()
+    except OSError as e:
+        writer.abort()
+        logger.warning(f"Result store write failed: {e}")
+        return None
+
+
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
 FRONTEND_DIR = os.path.join(CURRENT_DIR, "..", "frontend")
 
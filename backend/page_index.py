@@ -0,0 +1,181 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import fitz
+
+from backend.utils import _detect_courier, _extract_quantity, _extract_order_number, courier_sort_order
+import logging
+logger = logging.getLogger("uvicorn.error")
+
+
+def content_key(data: bytes) -> str:
+    """Index key of an uploaded file: hash of its bytes."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def index_page(pno: int, text: str) -> Dict:
+    """Per-page metadata from the text layer only (no rendering)."""
+    return {
+        "page": pno,
+        "courier": _detect_courier(text) or "__unknown__",
+        "qty": _extract_quantity(text),
+        "order_no": _extract_order_number(text),
+    }
+
+
+def iter_page_index(doc: fitz.Document, start: int = 0, stop: Optional[int] = None):
+    stop = len(doc) if stop is None else min(stop, len(doc))
+    for pno in range(start, stop):
+        try:
+            text = doc[pno].get_text("text") or ""
+        except Exception:
+            text = ""
+        yield index_page(pno, text)
+
+
+def summarize_index(pages: Iterable[Dict]) -> Dict:
+    couriers: Dict[str, int] = {}
+    order_ids = set()
+    total_pages = 0
+    total_qty = 0
+    unknown_qty = 0
+    for entry in pages:
+        total_pages += 1
+        couriers[entry["courier"]] = couriers.get(entry["courier"], 0) + 1
+        if entry["qty"] is None:
+            unknown_qty += 1
+        else:
+            total_qty += entry["qty"]
+        if entry["order_no"]:
+            order_ids.add(entry["order_no"])
+    return {
+        "pages": total_pages,
+        "couriers": couriers,
+        "total_qty": total_qty,
+        "pages_without_qty": unknown_qty,
+        "order_ids": len(order_ids),
+    }
+
+
+class PageIndexStore:
+    """
+    Disk backed store of page indexes, one JSON file per uploaded file keyed
+    by content_key(). Files live on disk so pool processes and other web
+    workers see indexes built by the /crop-pdf/index endpoint. At most
+    `max_entries` indexes are kept, least recently used are removed first.
+    """
+
+    def __init__(self, directory, max_entries: int):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.json"
+
+    def get(self, key: str) -> Optional[List[Dict]]:
+        path = self._path(key)
+        try:
+            pages = json.loads(path.read_text())
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return pages
+
+    def put(self, key: str, pages: List[Dict]):
+        path = self._path(key)
+        tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            tmp.write_text(json.dumps(pages))
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.warning(f"Page index write failed: {e}")
+            return
+        self._evict()
+
+    def put_combined(self, keys: List[str], key: str) -> bool:
+        """
+        Store the index of a merged document (the files of `keys`, in order)
+        under `key`, if every part is indexed.
+        """
+        combined = []
+        for part_key in keys:
+            pages = self.get(part_key)
+            if pages is None:
+                return False
+            offset = len(combined)
+            combined.extend(dict(entry, page=entry["page"] + offset) for entry in pages)
+        self.put(key, combined)
+        return True
+
+    def _evict(self):
+        with self._lock:
+            entries = []
+            for path in self.directory.glob("*.json"):
+                try:
+                    entries.append((path.stat().st_mtime, path))
+                except OSError:
+                    continue
+            if len(entries) <= self.max_entries:
+                return
+            entries.sort()
+            for _, path in entries[:len(entries) - self.max_entries]:
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
+
+
+def sort_meta_from_index(pages: List[Dict], removed_pages=()) -> List[Tuple[int, str, Optional[int]]]:
+    """
+    (pno, courier, qty) tuples for courier_sort_order from an index, with the
+    pages dropped by dedupe_pages taken out and the rest renumbered.
+    """
+    removed_pages = set(removed_pages)
+    kept = [entry for entry in pages if entry["page"] not in removed_pages]
+    return [(pno, entry["courier"], entry["qty"]) for pno, entry in enumerate(kept)]
+
+
+@lru_cache(maxsize=128)
+def _courier_order(key: str, removed_pages: Tuple[int, ...]) -> Tuple[int, ...]:
+    pages = page_index.get(key) if page_index is not None else None
+    if pages is None:
+        raise KeyError(key)  # not cached, the index may show up later
+    return tuple(courier_sort_order(sort_meta_from_index(pages, removed_pages)))
+
+
+def cached_courier_order(key: str, removed_pages=()) -> Optional[List[int]]:
+    """
+    Courier sort order of an indexed upload, computed from its index without
+    opening the document. Indexes are keyed by content, so the order of a key
+    never changes and is kept in memory for repeat requests.
+    """
+    try:
+        return list(_courier_order(key, tuple(removed_pages)))
+    except KeyError:
+        return None
+
+
+def _default_store() -> Optional[PageIndexStore]:
+    max_entries = int(os.getenv("PAGE_INDEX_CACHE_SIZE", "256"))
+    if max_entries <= 0:
+        return None
+    directory = os.getenv(
+        "PAGE_INDEX_DIR",
+        os.path.join(tempfile.gettempdir(), "pdf_croper_page_index"),
+    )
+    try:
+        return PageIndexStore(directory, max_entries)
+    except OSError as e:
+        logger.warning(f"Page index cache disabled: {e}")
+        return None
+
+
+page_index = _default_store()
@@ -4,7 +4,7 @@ import fitz
 from operator import le
 import os
 from fastapi import FastAPI , File, UploadFile,Form,Query,HTTPException 
-from fastapi.responses import FileResponse, StreamingResponse
+from fastapi.responses import FileResponse
 from fastapi.middleware.cors import CORSMiddleware
 from typing import Annotated, List, Optional
 from io import BytesIO
@@ -12,36 +12,29 @@ import fitz  # PyMuPDF
 import zipfile
 import datetime
 import base64
+import re
 from backend.utils import *
+from backend.profiling import stage as profile_stage
+from backend.page_index import content_key, cached_courier_order
 import logging
 logger = logging.getLogger("uvicorn.error")
 logger.setLevel(logging.INFO)
 
 
-def process_pdf(input_pdf, filter):
-    original = fitz.open(stream=input_pdf, filetype="pdf")
-    final_doc = fitz.open()
-
-    # STEP 1 — SORT FIRST (ALWAYS USE ORIGINAL TEXT PDF)
-    working_doc = original  # default
-
-    if filter.get("sort_courier"):
-        pdf = sort_courier(original)
-        working_doc = pdf
-
+def apply_page_filters(doc, filter):
+    """
+    Per-page filters: datetime stamp (in place) and raster crop.
+    The returned doc has the same pages in the same order as `doc`.
+    """
     if filter.get("print_datetime"):
-        try:
-            print_datetime_exactly_right_of_product_details(
-                doc=working_doc,  # Directly pass the document
-                phrase="Product Details",  # The phrase to search for
-                fontname="Times-Roman",    # Font style
-                fontsize=10.0,             # Font size
-                x_gap=7.0,                # Gap to the right of the phrase
-                y_shift=11.0              # Vertical shift to align with the phrase
-            )
-        except Exception as e:
-            logger.error(f"Error printing datetime: {e}")
-            return False
+        print_datetime_exactly_right_of_product_details(
+            doc=doc,  # Directly pass the document
+            phrase="Product Details",  # The phrase to search for
+            fontname="Times-Roman",    # Font style
+            fontsize=10.0,             # Font size
+            x_gap=7.0,                # Gap to the right of the phrase
+            y_shift=11.0              # Vertical shift to align with the phrase
+        )
 
     if filter.get("keep_invoice_no_crop"):
         try:
@@ -49,147 +42,273 @@ def process_pdf(input_pdf, filter):
         except:
             pass
 
-    # STEP 2 — APPLY REMOVE WHITE AFTER SORTING
+    # APPLY REMOVE WHITE AFTER SORTING
     if filter.get("remove_white"):
         try:
-            working_doc = remove_pdf_whitespace(working_doc)
+            doc = remove_pdf_whitespace(doc)
         except:
             pass
 
-    # STEP 3 — Insert final working pages
-
-    final_doc.insert_pdf(working_doc)
-
-    # STEP 4 — Add Summary Page at End
-    if filter.get("bottom_of_the_table"):
-        try:
-            extracted_data = extract_meesho_data(original)
-            if extracted_data:
-                order_summary = create_order_summary(extracted_data)
-                courier_summary = create_courier_summary(extracted_data)
-                company_summary = create_company_summary(extracted_data)
+    return doc
 
-                buffer = create_pdf_report(order_summary, courier_summary, company_summary)
-                summary_doc = fitz.open(stream=buffer.getvalue(), filetype="pdf")
 
-                final_doc.insert_pdf(summary_doc)
-
-        except Exception as e:
-            logger.exception(e)
-
-    return final_doc
+def build_summary_doc(extracted_data):
+    """Summary tables page(s) for the given label records, or None."""
+    if not extracted_data:
+        return None
+    order_summary = create_order_summary(extracted_data)
+    courier_summary = create_courier_summary(extracted_data)
+    company_summary = create_company_summary(extracted_data)
 
+    buffer = create_pdf_report(order_summary, courier_summary, company_summary)
+    return fitz.open(stream=buffer.getvalue(), filetype="pdf")
 
 
+def process_pdf(input_pdf, filter, report=None):
+    original = fitz.open(stream=input_pdf, filetype="pdf")
+    final_doc = fitz.open()
 
-def merge_and_order_id(input_pdf, separate_order_list, filter):
-    
-    order_ids = []
-    if separate_order_list and separate_order_list.strip():
-        # split by newline or comma - handle commas as well
-        raw_lines = [line.strip() for line in separate_order_list.replace(",", "\n").splitlines()]
-        order_ids = [o for o in raw_lines if o]
-        logger.info(f"User requested separate extraction for order ids: {order_ids}")
-    
-    if order_ids:
-        selected_doc = fitz.open()   # final combined doc with selected orders
-        cleaned_doc = fitz.open()    # final combined doc with non-selected orders
+    # STEP 0 — DROP DUPLICATE LABELS (before any expensive work)
+    removed = []
+    if filter.get("remove_duplicates"):
+        with profile_stage("dedupe"):
+            original, removed = dedupe_pages(original)
+        if removed:
+            logger.info(f"Removed {len(removed)} duplicate pages: {removed}")
+        if report is not None:
+            report.setdefault("duplicates", []).extend(removed)
 
-        logger.info("Merging PDFs...")
-        merged_doc = fitz.open()
+    # STEP 1 — SORT FIRST (ALWAYS USE ORIGINAL TEXT PDF)
+    working_doc = original  # default
 
+    if filter.get("sort_courier"):
+        # reuse the index of a previous /crop-pdf/index call on the same file
+        final_order = cached_courier_order(content_key(input_pdf), [r["page"] for r in removed])
+        with profile_stage("sort"):
+            pdf = sort_courier(original, final_order=final_order)
+        working_doc = pdf
 
-        for item in input_pdf:
-            temp_doc = fitz.open(stream=item["bytes"], filetype="pdf")
-            merged_doc.insert_pdf(temp_doc)
-            
-        print('1')
-        for file in input_pdf:
-            original_doc = fitz.open(stream=file["bytes"], filetype="pdf")
+    # STEP 2 — DATETIME + REMOVE WHITE AFTER SORTING
+    try:
+        with profile_stage("page_filters"):
+            working_doc = apply_page_filters(working_doc, filter)
+    except Exception as e:
+        logger.error(f"Error printing datetime: {e}")
+        return False
+
+    # STEP 2b — N-UP: pack the cropped labels onto A4 sheets
+    if filter.get("labels_per_sheet", 1) > 1:
+        with profile_stage("impose"):
+            working_doc = impose_labels(
+                working_doc, filter["labels_per_sheet"], crop=not filter.get("remove_white")
+            )
 
-            # Step 1 – Extract pages per order
-            orders_pages_map, pages_to_remove = extract_orders_from_pdf(original_doc, order_ids)
+    # STEP 3 — Insert final working pages
 
-            # Step 2 – Add selected pages into selected_doc
-            selected_pages = []
-            for pages in orders_pages_map.values():
-                selected_pages.extend(pages)
-            selected_pages = sorted(set(selected_pages))  # dedupe
+    with profile_stage("insert_pdf"):
+        final_doc.insert_pdf(working_doc)
 
-            if selected_pages:
-                for p in selected_pages:
-                    selected_doc.insert_pdf(original_doc, from_page=p, to_page=p)
+    # STEP 4 — Add Summary Page at End
+    if filter.get("bottom_of_the_table"):
+        try:
+            with profile_stage("summary"):
+                summary_doc = build_summary_doc(extract_meesho_data(original))
+            if summary_doc is not None:
+                final_doc.insert_pdf(summary_doc)
 
-            # Step 3 – Add remaining pages into cleaned_doc
-            for p in range(len(original_doc)):
-                if p not in selected_pages:
-                    cleaned_doc.insert_pdf(original_doc, from_page=p, to_page=p)
+        except Exception as e:
+            logger.exception(e)
 
-    
-        # Step 4 – Apply filters
-        final_selected = process_pdf(selected_doc.tobytes(), filter)   # pass bytes directly
-        final_cleaned = process_pdf(cleaned_doc.tobytes(), filter)
-        print('data',input_pdf[0]['filename'])
-        # Step 5 – Return ZIP with exactly 2 PDFs
-        zip_buffer = BytesIO()
-        with zipfile.ZipFile(zip_buffer, "w") as zip_file:
-            zip_file.writestr(f"{input_pdf[0]['filename']}_all_merged.pdf", final_selected.tobytes())
-            zip_file.writestr("cleaned_original.pdf", final_cleaned.tobytes())
-
-        zip_buffer.seek(0)
-        return StreamingResponse(
-            zip_buffer,
-            media_type="application/zip",
-            headers={"Content-Disposition": "attachment; filename=orders_output.zip"}
-        )
+    return final_doc
 
 
-def only_separate_order_with_filter(input_pdf, separate_order_list, filter):
-    order_ids = []
-    if separate_order_list and separate_order_list.strip():
-        # split by newline or comma - handle commas as well
-        raw_lines = [line.strip() for line in separate_order_list.replace(",", "\n").splitlines()]
-        order_ids = [o for o in raw_lines if o]
-        logger.info(f"User requested separate extraction for order ids: {order_ids}")
+def parse_order_ids(separate_order_list):
+    """Order ids from the textarea, one per line or comma separated."""
+    if not separate_order_list or not separate_order_list.strip():
+        return []
+    # split by newline or comma - handle commas as well
+    raw_lines = [line.strip() for line in separate_order_list.replace(",", "\n").splitlines()]
+    return list(dict.fromkeys(o for o in raw_lines if o))
+
+
+def _insert_pages(out, src, pages):
+    """
+    Append `pages` of src to out, copying contiguous runs in one insert_pdf call.
+    Objects shared between pages (e.g. the ICC profile of the crop images)
+    are copied once per call, so prefer _select_pages for large page sets.
+    """
+    i = 0
+    while i < len(pages):
+        j = i
+        while j + 1 < len(pages) and pages[j + 1] == pages[j] + 1:
+            j += 1
+        out.insert_pdf(src, from_page=pages[i], to_page=pages[j])
+        i = j + 1
+    return out
+
+
+def _select_pages(src, pages):
+    """
+    Copy of src reduced to `pages` (in that order), with one graft of shared
+    objects. Save with garbage=1 to drop the objects of unselected pages.
+    """
+    out = fitz.open()
+    out.insert_pdf(src)
+    out.select(pages)
+    return out
+
+
+# Outputs of the order split a request can ask for (filter["outputs"])
+SPLIT_OUTPUTS = ("selected", "cleaned", "per_order")
+
+
+def requested_outputs(filter):
+    """filter["outputs"], defaulting to selected + cleaned (+ per_order with split_per_order)."""
+    outputs = filter.get("outputs")
+    if outputs:
+        return set(outputs)
+    outputs = {"selected", "cleaned"}
+    if filter.get("split_per_order"):
+        outputs.add("per_order")
+    return outputs
+
+
+def split_orders(input_pdf, order_ids, filter, report=None):
+    """
+    Split engine for "separate order list".
+
+    Every upload is opened once and every page is scanned once to build the
+    page -> order index (plus courier/qty/summary data from the same text).
+    The per-page filters then run once on the combined document, and the
+    outputs are assembled from the processed pages:
+
+        {"selected": doc, "cleaned": doc, "orders": {order_id: doc}}
+
+    Only the outputs named by requested_outputs(filter) are built, and the
+    expensive per-page work (stamp, raster crop, summary/sort metadata) is
+    only done for pages that end up in one of them.
+    """
+    wanted = requested_outputs(filter)
+    wants_selected = bool(wanted & {"selected", "per_order"})
+
+    # STEP 1 — one combined document, each upload opened once
+    combined = fitz.open()
+    for item in input_pdf:
+        with profile_stage("combine_insert_pdf"):
+            src = item.get("doc") or fitz.open(stream=item["bytes"], filetype="pdf")
+            combined.insert_pdf(src)
+
+    if filter.get("remove_duplicates"):
+        combined, removed = dedupe_pages(combined)
+        if report is not None:
+            report.setdefault("duplicates", []).extend(removed)
+
+    # STEP 2 — single text scan: page -> orders index + sort/summary metadata
+    page_orders = []
+    page_meta = []
+    records = []
+    for pno in range(len(combined)):
+        with profile_stage("split_text_scan", pno):
+            try:
+                text = combined[pno].get_text("text") or ""
+            except Exception:
+                text = ""
+            oids = [oid for oid in order_ids if oid in text]
+            page_orders.append(oids)
+
+            # metadata only for pages that are emitted
+            emitted = wants_selected if oids else "cleaned" in wanted
+            if filter.get("sort_courier"):
+                page_meta.append((pno, _detect_courier(text), _extract_quantity(text)) if emitted else None)
+            if filter.get("bottom_of_the_table"):
+                summarized = "selected" in wanted if oids else "cleaned" in wanted
+                records.append(extract_meesho_record(text) if summarized else None)
+
+    selected_pages = [p for p, oids in enumerate(page_orders) if oids]
+    cleaned_pages = [p for p, oids in enumerate(page_orders) if not oids]
+
+    # STEP 3 — per-page filters, once per emitted page. Pages that are in no
+    # requested output are dropped first and never stamped or rendered.
+    emitted_pages = sorted(
+        (selected_pages if wants_selected else []) + (cleaned_pages if "cleaned" in wanted else [])
+    )
+    if len(emitted_pages) == len(combined):
+        to_process = combined
+    elif emitted_pages:
+        to_process = _select_pages(combined, emitted_pages)
+    else:
+        to_process = fitz.open()
+    position = {p: i for i, p in enumerate(emitted_pages)}
+
+    try:
+        with profile_stage("page_filters"):
+            processed = apply_page_filters(to_process, filter)
+    except Exception as e:
+        logger.error(f"Error printing datetime: {e}")
+        processed = to_process
+
+    def build(pages, with_summary):
+        with profile_stage("build_output"):
+            if filter.get("sort_courier"):
+                pages = courier_sort_order([page_meta[p] for p in pages])
+            processed_pages = [position[p] for p in pages]
+            if with_summary:
+                out = _select_pages(processed, processed_pages) if pages else fitz.open()
+            else:
+                out = _insert_pages(fitz.open(), processed, processed_pages)
+            if filter.get("labels_per_sheet", 1) > 1:
+                out = impose_labels(out, filter["labels_per_sheet"], crop=not filter.get("remove_white"))
+
+            if with_summary and filter.get("bottom_of_the_table") and pages:
+                page_records = [records[p] for p in pages]
+                if all(r is not None for r in page_records):
+                    try:
+                        summary_doc = build_summary_doc(page_records)
+                        if summary_doc is not None:
+                            out.insert_pdf(summary_doc)
+                    except Exception as e:
+                        logger.exception(e)
+            return out
+
+    outputs = {"orders": {}}
+    if "selected" in wanted:
+        outputs["selected"] = build(selected_pages, True)
+    if "cleaned" in wanted:
+        outputs["cleaned"] = build(cleaned_pages, True)
+
+    if "per_order" in wanted:
+        order_pages = {}
+        for pno, oids in enumerate(page_orders):
+            for oid in oids:
+                order_pages.setdefault(oid, []).append(pno)
+        for oid, pages in order_pages.items():
+            outputs["orders"][oid] = build(pages, False)
+
+    return outputs
+
+
+def orders_zip_bytes(outputs, selected_name, cleaned_name):
+    """ZIP with the selected / cleaned / orders/<id>.pdf documents present in split_orders outputs."""
+    zip_buffer = BytesIO()
+    with zipfile.ZipFile(zip_buffer, "w") as zip_file:
+        if "selected" in outputs:
+            zip_file.writestr(selected_name, outputs["selected"].tobytes(garbage=1))
+        if "cleaned" in outputs:
+            zip_file.writestr(cleaned_name, outputs["cleaned"].tobytes(garbage=1))
+        for oid, doc in outputs["orders"].items():
+            safe_oid = re.sub(r"[^A-Za-z0-9_.-]", "_", oid)
+            zip_file.writestr(f"orders/{safe_oid}.pdf", doc.tobytes())
+    return zip_buffer.getvalue()
+
+
+def merge_and_order_id_zip(input_pdf, separate_order_list, filter, report=None):
+    """Bytes of the merge + order split ZIP, None when no order ids were given."""
+    order_ids = parse_order_ids(separate_order_list)
     
     if order_ids:
-        selected_doc = fitz.open()   # final combined doc with selected orders
-        cleaned_doc = fitz.open()    # final combined doc with non-selected orders            
-
-        for file in input_pdf:
-            original_doc = fitz.open(stream=file["bytes"], filetype="pdf")
-
-            # Step 1 – Extract pages per order
-            orders_pages_map, pages_to_remove = extract_orders_from_pdf(original_doc, order_ids)
-
-            # Step 2 – Add selected pages into selected_doc
-            selected_pages = []
-            for pages in orders_pages_map.values():
-                selected_pages.extend(pages)
-            selected_pages = sorted(set(selected_pages))  # dedupe
-
-            if selected_pages:
-                for p in selected_pages:
-                    selected_doc.insert_pdf(original_doc, from_page=p, to_page=p)
-
-            # Step 3 – Add remaining pages into cleaned_doc
-            for p in range(len(original_doc)):
-                if p not in selected_pages:
-                    cleaned_doc.insert_pdf(original_doc, from_page=p, to_page=p)
-
-        # Step 4 – Apply filters
-        final_selected = process_pdf(selected_doc.tobytes(), filter)   # pass bytes directly
-        final_cleaned = process_pdf(cleaned_doc.tobytes(), filter)
-
-        # Step 5 – Return ZIP with exactly 2 PDFs
-        zip_buffer = BytesIO()
-        with zipfile.ZipFile(zip_buffer, "w") as zip_file:
-            zip_file.writestr("selected_orders.pdf", final_selected.tobytes())
-            zip_file.writestr("cleaned_original.pdf", final_cleaned.tobytes())
-
-        zip_buffer.seek(0)
-        return StreamingResponse(
-            zip_buffer,
-            media_type="application/zip",
-            headers={"Content-Disposition": "attachment; filename=orders_output.zip"}
+        logger.info(f"User requested separate extraction for order ids: {order_ids}")
+        outputs = split_orders(input_pdf, order_ids, filter, report)
+
+        return orders_zip_bytes(
+            outputs, f"{input_pdf[0]['filename']}_all_merged.pdf", "cleaned_original.pdf"
         )
@@ -0,0 +1,167 @@
+import asyncio
+import json
+import os
+import zipfile
+from typing import AsyncIterable, AsyncIterator, Awaitable, Callable, List, Tuple
+
+import logging
+logger = logging.getLogger("uvicorn.error")
+
+
+# Documents a request may hold at once (read, processing or waiting to be
+# written). Caps memory per request independent of the number of uploads.
+MAX_IN_FLIGHT = int(os.getenv("CROP_PDF_MAX_IN_FLIGHT", "4"))
+
+# ZIP bytes are handed to the response in chunks of this size
+ZIP_CHUNK_SIZE = 256 * 1024
+
+# /crop-pdf/stream builds its ZIP in memory up to this size, then on disk
+STREAM_SPOOL_BYTES = int(os.getenv("CROP_PDF_STREAM_SPOOL_MB", "16")) * 1024 * 1024
+
+
+class _ChunkSink:
+    """Write-only, non-seekable file object that collects what ZipFile writes."""
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.offset = 0
+
+    def write(self, data):
+        self.buffer += data
+        self.offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.offset
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        while self.buffer:
+            chunk = bytes(self.buffer[:ZIP_CHUNK_SIZE])
+            del self.buffer[:ZIP_CHUNK_SIZE]
+            yield chunk
+
+
+async def iter_uploads(files: List) -> AsyncIterator[Tuple[str, bytes]]:
+    """(filename, bytes) of each UploadFile, read one at a time."""
+    for index, file in enumerate(files):
+        data = await file.read()
+        yield getattr(file, "filename", None) or f"input_{index+1}.pdf", data
+
+
+async def zip_pipeline(
+    files: AsyncIterable[Tuple[str, bytes]],
+    process: Callable[[bytes], Awaitable[Tuple[bytes, dict]]],
+    max_in_flight: int = MAX_IN_FLIGHT,
+    report_name: str = None,
+    errors: List = None,
+) -> AsyncIterator[bytes]:
+    """
+    Read -> process -> write pipeline over (filename, bytes) uploads (from
+    iter_uploads, or parsed from a streamed body), yielding ZIP bytes.
+
+    A reader task pulls the next upload only when an in-flight slot is free
+    (so `files` is consumed at the pace of the processing), a worker per
+    in-flight slot runs `process` (which dispatches the CPU work to the
+    executor) and this generator writes finished files into the ZIP in
+    upload order. The stages overlap across
+    files; at most `max_in_flight` documents are held between reading and
+    being written. With `report_name`, the merged duplicate report is added
+    as a last JSON entry (headers are already sent by then).
+
+    A failure on the first file is raised (nothing has been sent yet). Later
+    failures cannot change the response status any more, so they become a
+    "<filename>.error.txt" entry and (filename, exception) is appended to
+    `errors`; the ZIP stays valid. An error raised by `files` itself is raised
+    after the files before it are written.
+    """
+    slots = asyncio.Semaphore(max_in_flight)
+    to_process: asyncio.Queue = asyncio.Queue(maxsize=max_in_flight)
+    results = {}
+    result_ready = asyncio.Condition()
+    source = files.__aiter__()
+    read = {"count": None, "error": None}  # set when the reader is done
+
+    async def reader():
+        index = 0
+        try:
+            while True:
+                await slots.acquire()
+                try:
+                    filename, data = await source.__anext__()
+                except StopAsyncIteration:
+                    break
+                await to_process.put((index, filename, data))
+                index += 1
+        except Exception as e:
+            read["error"] = e
+        finally:
+            async with result_ready:
+                read["count"] = index
+                result_ready.notify_all()
+        for _ in range(max_in_flight):
+            await to_process.put(None)
+
+    async def worker():
+        while True:
+            item = await to_process.get()
+            if item is None:
+                return
+            index, filename, data = item
+            try:
+                outcome = (filename, await process(data), None)
+            except Exception as e:
+                outcome = (filename, None, e)
+            async with result_ready:
+                results[index] = outcome
+                result_ready.notify_all()
+
+    tasks = [asyncio.create_task(reader())]
+    tasks += [asyncio.create_task(worker()) for _ in range(max_in_flight)]
+
+    sink = _ChunkSink()
+    report = {}
+    try:
+        with zipfile.ZipFile(sink, "w") as zip_file:
+            index = 0
+            while True:
+                async with result_ready:
+                    await result_ready.wait_for(
+                        lambda: index in results or read["count"] is not None and index >= read["count"]
+                    )
+                    if index not in results:
+                        break
+                    filename, processed, error = results.pop(index)
+                if error is not None:
+                    logger.error(f"Error processing {filename}: {error}")
+                    if index == 0:
+                        raise error
+                    detail = getattr(error, "detail", None) or str(error)
+                    zip_file.writestr(f"{filename}.error.txt", f"{filename} was not processed: {detail}\n")
+                    if errors is not None:
+                        errors.append((filename, error))
+                else:
+                    processed_bytes, file_report = processed
+                    report.setdefault("duplicates", []).extend(file_report.get("duplicates", []))
+                    zip_file.writestr(filename, processed_bytes)
+                    del processed_bytes
+                del processed
+                slots.release()
+
+                for chunk in sink.drain():
+                    yield chunk
+                index += 1
+
+            if read["error"] is not None:
+                raise read["error"]
+
+            if report_name is not None:
+                zip_file.writestr(report_name, json.dumps(report, indent=2, default=str))
+
+        for chunk in sink.drain():
+            yield chunk
+    finally:
+        for task in tasks:
+            task.cancel()
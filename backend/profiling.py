@@ -0,0 +1,140 @@
+import contextvars
+import hmac
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
+from collections import Counter
+from contextlib import contextmanager
+from io import BytesIO
+from pathlib import Path
+from typing import Optional
+
+import logging
+logger = logging.getLogger("uvicorn.error")
+
+
+# Opt-in per-request profiling. Only requests with the admin token may turn
+# it on; nothing is recorded (and stage() is a no-op) otherwise.
+ADMIN_TOKEN = os.getenv("CROP_PDF_ADMIN_TOKEN", "")
+PROFILE_DIR = Path(os.getenv(
+    "CROP_PDF_PROFILE_DIR",
+    os.path.join(tempfile.gettempdir(), "pdf_croper_profiles"),
+))
+
+_current: "contextvars.ContextVar[Optional[RequestProfiler]]" = contextvars.ContextVar(
+    "crop_pdf_profiler", default=None
+)
+
+
+class RequestProfiler:
+    """
+    Per-request stage/page timings plus a sampled CPU profile of the thread
+    running the job, folded into "frame;frame;frame count" lines that
+    flamegraph.pl / speedscope read directly.
+    """
+
+    def __init__(self, sample_interval: float = 0.005):
+        self.id = uuid.uuid4().hex
+        self.sample_interval = sample_interval
+        self.stages = []
+        self.samples: Counter = Counter()
+        self.total = 0.0
+        self._stop = threading.Event()
+
+    @contextmanager
+    def stage(self, name: str, page: Optional[int] = None):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages.append({
+                "stage": name,
+                "page": page,
+                "ms": round((time.perf_counter() - start) * 1000, 3),
+            })
+
+    def _sample(self, thread_id: int):
+        while not self._stop.wait(self.sample_interval):
+            frame = sys._current_frames().get(thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+    def run(self, fn, *args):
+        """Run fn(*args) in the current thread with this profiler active."""
+        token = _current.set(self)
+        sampler = threading.Thread(target=self._sample, args=(threading.get_ident(),), daemon=True)
+        self._stop.clear()
+        sampler.start()
+        start = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            self.total = time.perf_counter() - start
+            self._stop.set()
+            sampler.join()
+            _current.reset(token)
+
+    def summary(self):
+        by_stage = {}
+        for rec in self.stages:
+            s = by_stage.setdefault(rec["stage"], {"count": 0, "total_ms": 0.0, "max_ms": 0.0, "slowest_page": None})
+            s["count"] += 1
+            s["total_ms"] = round(s["total_ms"] + rec["ms"], 3)
+            if rec["ms"] > s["max_ms"]:
+                s["max_ms"] = rec["ms"]
+                s["slowest_page"] = rec["page"]
+        return {
+            "id": self.id,
+            "total_ms": round(self.total * 1000, 3),
+            "sample_interval_ms": self.sample_interval * 1000,
+            "samples": sum(self.samples.values()),
+            "stages": by_stage,
+        }
+
+    def artifact(self) -> bytes:
+        """ZIP with summary.json, stages.json (per page) and profile.folded."""
+        buffer = BytesIO()
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zf:
+            zf.writestr("summary.json", json.dumps(self.summary(), indent=2))
+            zf.writestr("stages.json", json.dumps(self.stages))
+            zf.writestr("profile.folded", "\n".join(f"{stack} {n}" for stack, n in self.samples.most_common()))
+        return buffer.getvalue()
+
+    def save(self) -> Path:
+        PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+        path = PROFILE_DIR / f"{self.id}.zip"
+        path.write_bytes(self.artifact())
+        logger.info(f"Profile {self.id}: {self.summary()['total_ms']} ms, saved to {path}")
+        return path
+
+
+@contextmanager
+def stage(name: str, page: Optional[int] = None):
+    """Time a block under `name` when the current request is being profiled."""
+    profiler = _current.get()
+    if profiler is None:
+        yield
+        return
+    with profiler.stage(name, page):
+        yield
+
+
+def profile_path(profile_id: str) -> Optional[Path]:
+    if not profile_id.isalnum():
+        return None
+    path = PROFILE_DIR / f"{profile_id}.zip"
+    return path if path.exists() else None
+
+
+def is_admin(token: Optional[str]) -> bool:
+    return bool(ADMIN_TOKEN) and token is not None and hmac.compare_digest(token, ADMIN_TOKEN)
@@ -0,0 +1,143 @@
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+import logging
+logger = logging.getLogger("uvicorn.error")
+
+
+class RenderCache:
+    """
+    Disk backed cache of encoded (JPEG) cropped page images.
+
+    Keys are built from the page content hash plus the render parameters, so a
+    hit can skip rendering and encoding completely. Total size on disk is
+    capped at `max_bytes`, least recently used entries are evicted first.
+
+    The directory may be shared by several processes (web workers, the
+    processing pool): entries written by another process are found on disk,
+    and the index is rebuilt from the directory every `rescan_every` writes
+    and before evicting, so the cap holds for the directory as a whole.
+    """
+
+    rescan_every = 32
+
+    def __init__(self, directory, max_bytes: int):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, int]" = OrderedDict()  # key -> size, oldest first
+        self._lock = threading.Lock()
+        self._puts = 0
+
+        # pick up entries left by a previous run / other processes
+        with self._lock:
+            self._rescan()
+            self._evict()
+
+    def _rescan(self):
+        """Rebuild the index from the shared directory, oldest (mtime) first."""
+        existing = []
+        for path in self.directory.glob("*.jpg"):
+            try:
+                st = path.stat()
+            except OSError:
+                continue
+            existing.append((st.st_mtime, path.stem, st.st_size))
+        self._entries = OrderedDict((key, size) for _, key, size in sorted(existing))
+        self.size = sum(self._entries.values())
+
+    @staticmethod
+    def make_key(page_hash: str, clip, dpi: int, jpeg_quality: int) -> str:
+        clip_key = ",".join(f"{v:.2f}" for v in clip)
+        raw = f"v2|{page_hash}|{clip_key}|{dpi}|{jpeg_quality}"
+        return hashlib.sha1(raw.encode()).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.jpg"
+
+    def get(self, key: str) -> Optional[bytes]:
+        # the file may have been written by another process, so look on disk
+        # even for keys this process has not seen
+        try:
+            data = self._path(key).read_bytes()
+        except OSError:
+            # never written, or evicted by another process sharing the directory
+            with self._lock:
+                self.size -= self._entries.pop(key, 0)
+                self.misses += 1
+            return None
+
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            else:
+                self._entries[key] = len(data)
+                self.size += len(data)
+
+        try:
+            os.utime(self._path(key))
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def put(self, key: str, data: bytes):
+        if len(data) > self.max_bytes:
+            return
+
+        path = self._path(key)
+        tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            tmp.write_bytes(data)
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.warning(f"Render cache write failed: {e}")
+            return
+
+        with self._lock:
+            self._puts += 1
+            if self._puts % self.rescan_every == 0:
+                self._rescan()
+            self.size -= self._entries.pop(key, 0)
+            self._entries[key] = len(data)
+            self.size += len(data)
+            if self.size > self.max_bytes:
+                # see what the other processes wrote before deciding what to drop
+                self._rescan()
+            self._evict()
+
+    def _evict(self):
+        while self.size > self.max_bytes and self._entries:
+            key, size = self._entries.popitem(last=False)
+            self.size -= size
+            try:
+                self._path(key).unlink()
+            except OSError:
+                pass
+
+
+def _default_cache() -> Optional[RenderCache]:
+    max_mb = int(os.getenv("RENDER_CACHE_MAX_MB", "512"))
+    if max_mb <= 0:
+        return None
+    directory = os.getenv(
+        "RENDER_CACHE_DIR",
+        os.path.join(tempfile.gettempdir(), "pdf_croper_render_cache"),
+    )
+    try:
+        return RenderCache(directory, max_mb * 1024 * 1024)
+    except OSError as e:
+        logger.warning(f"Render cache disabled: {e}")
+        return None
+
+
+render_cache = _default_cache()
@@ -0,0 +1,192 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, Iterable, Optional
+
+import logging
+logger = logging.getLogger("uvicorn.error")
+
+
+def result_key(file_hashes: Iterable[str], options: Dict) -> str:
+    """
+    Id of a result: hash of the uploaded files (in order) and every option
+    that changes the output. The same request always maps to the same id.
+    """
+    h = hashlib.sha256()
+    for file_hash in file_hashes:
+        h.update(file_hash.encode())
+        h.update(b"|")
+    h.update(json.dumps(options, sort_keys=True, default=str).encode())
+    return h.hexdigest()[:32]
+
+
+class ResultWriter:
+    """Streams a result body to disk; commit() publishes it under its key."""
+
+    def __init__(self, store: "ResultStore", key: str, media_type: str, filename: str, headers=None):
+        self.store = store
+        self.key = key
+        self.meta = {"id": key, "media_type": media_type, "filename": filename, "headers": headers or {}}
+        self._hash = hashlib.sha256()
+        self._size = 0
+        self._tmp = store._path(key).with_suffix(f".{uuid.uuid4().hex}.tmp")
+        self._file = open(self._tmp, "wb")
+
+    def write(self, data: bytes):
+        self._file.write(data)
+        self._hash.update(data)
+        self._size += len(data)
+
+    def commit(self) -> Optional[Dict]:
+        """Publish the result; None (and nothing kept) when it exceeds the store size."""
+        self._file.close()
+        if self._size > self.store.max_bytes:
+            self.abort()
+            return None
+        self.meta.update({
+            "etag": f'"{self._hash.hexdigest()}"',
+            "size": self._size,
+            "created": time.time(),
+        })
+        os.replace(self._tmp, self.store._path(self.key))
+        meta_tmp = self._tmp.with_suffix(".meta")
+        meta_tmp.write_text(json.dumps(self.meta))
+        os.replace(meta_tmp, self.store._meta_path(self.key))
+        self.store.purge_expired()
+        self.store.evict()
+        return self.meta
+
+    def abort(self):
+        self._file.close()
+        try:
+            self._tmp.unlink()
+        except OSError:
+            pass
+
+
+class ResultStore:
+    """
+    Finished outputs on local disk, so a re-download (dropped connection,
+    print kiosk retry) is a file read instead of a reprocess.
+
+    Each result is `<id>.bin` plus `<id>.json` metadata (media type, filename,
+    response headers and a content-derived ETag). Results expire `ttl`
+    seconds after they were written; expired results are purged on writes
+    and, at most every `purge_interval` seconds, on reads. Total size on disk
+    is capped at `max_bytes`, least recently used results are evicted first.
+    """
+
+    purge_interval = 60.0
+
+    def __init__(self, directory, ttl: float, max_bytes: int):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._next_purge = 0.0
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.bin"
+
+    def _meta_path(self, key: str) -> Path:
+        return self.directory / f"{key}.json"
+
+    def get(self, key: str) -> Optional[Dict]:
+        """Metadata (with "path" and "expires") of a live result, else None."""
+        if not key.isalnum():
+            return None
+        if time.monotonic() >= self._next_purge:
+            self.purge_expired()
+        try:
+            meta = json.loads(self._meta_path(key).read_text())
+        except (OSError, ValueError):
+            return None
+
+        expires = meta["created"] + self.ttl
+        if expires <= time.time() or not self._path(key).exists():
+            self._remove(key)
+            return None
+        try:
+            os.utime(self._path(key))  # recently used, evicted last
+        except OSError:
+            pass
+        meta["path"] = str(self._path(key))
+        meta["expires"] = expires
+        return meta
+
+    def writer(self, key: str, media_type: str, filename: str, headers=None) -> ResultWriter:
+        return ResultWriter(self, key, media_type, filename, headers)
+
+    def put(self, key: str, body: bytes, media_type: str, filename: str, headers=None) -> Optional[Dict]:
+        try:
+            writer = self.writer(key, media_type, filename, headers)
+        except OSError as e:
+            logger.warning(f"Result store write failed: {e}")
+            return None
+        try:
+            writer.write(body)
+            return writer.commit()
+        except OSError as e:
+            writer.abort()
+            logger.warning(f"Result store write failed: {e}")
+            return None
+
+    def _remove(self, key: str):
+        for path in (self._meta_path(key), self._path(key)):
+            try:
+                path.unlink()
+            except OSError:
+                pass
+
+    def purge_expired(self):
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            self._next_purge = time.monotonic() + self.purge_interval
+            for path in self.directory.glob("*.json"):
+                try:
+                    if path.stat().st_mtime < cutoff:
+                        self._remove(path.stem)
+                except OSError:
+                    continue
+
+    def evict(self):
+        """Remove least recently used results until the store fits in max_bytes."""
+        with self._lock:
+            entries = []
+            for path in self.directory.glob("*.bin"):
+                try:
+                    st = path.stat()
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path.stem))
+            size = sum(entry[1] for entry in entries)
+            for _, entry_size, key in sorted(entries):
+                if size <= self.max_bytes:
+                    break
+                self._remove(key)
+                size -= entry_size
+
+
+def _default_store() -> Optional[ResultStore]:
+    ttl = float(os.getenv("RESULT_STORE_TTL", "3600"))
+    max_mb = int(os.getenv("RESULT_STORE_MAX_MB", "1024"))
+    if ttl <= 0 or max_mb <= 0:
+        return None
+    directory = os.getenv(
+        "RESULT_STORE_DIR",
+        os.path.join(tempfile.gettempdir(), "pdf_croper_results"),
+    )
+    try:
+        return ResultStore(directory, ttl, max_mb * 1024 * 1024)
+    except OSError as e:
+        logger.warning(f"Result store disabled: {e}")
+        return None
+
+
+result_store = _default_store()
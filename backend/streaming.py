@@ -0,0 +1,86 @@
+from typing import AsyncIterator, List, Tuple
+
+from fastapi import HTTPException, Request
+
+try:
+    import python_multipart as multipart
+    from python_multipart.multipart import parse_options_header
+except ModuleNotFoundError:  # older python-multipart
+    import multipart
+    from multipart.multipart import parse_options_header
+
+
+class _PartCollector:
+    """Multipart callbacks that collect every finished part as an event."""
+
+    def __init__(self):
+        self.events: List[Tuple] = []
+        self._header_name = b""
+        self._header_value = b""
+        self._disposition = b""
+        self._data = bytearray()
+
+    def on_part_begin(self):
+        self._disposition = b""
+        self._data = bytearray()
+
+    def on_part_data(self, data, start, end):
+        self._data += data[start:end]
+
+    def on_header_field(self, data, start, end):
+        self._header_name += data[start:end]
+
+    def on_header_value(self, data, start, end):
+        self._header_value += data[start:end]
+
+    def on_header_end(self):
+        if self._header_name.lower() == b"content-disposition":
+            self._disposition = self._header_value
+        self._header_name = b""
+        self._header_value = b""
+
+    def on_part_end(self):
+        _, options = parse_options_header(self._disposition)
+        name = options.get(b"name", b"").decode("utf-8", "replace")
+        if b"filename" in options:
+            filename = options[b"filename"].decode("utf-8", "replace")
+            self.events.append(("file", name, filename, bytes(self._data)))
+        else:
+            self.events.append(("field", name, self._data.decode("utf-8", "replace")))
+        self._data = bytearray()
+
+    def callbacks(self):
+        return {
+            "on_part_begin": self.on_part_begin,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+        }
+
+
+async def iter_multipart(request: Request) -> AsyncIterator[Tuple]:
+    """
+    Parse a multipart/form-data body while it is still being received.
+
+    Yields ("field", name, value) and ("file", name, filename, data) as soon as
+    each part has fully arrived, so callers can start working on the first
+    upload while later ones are still in transit.
+    """
+    _, params = parse_options_header(request.headers.get("content-type", ""))
+    boundary = params.get(b"boundary")
+    if not boundary:
+        raise HTTPException(status_code=400, detail="Expected multipart/form-data body")
+
+    collector = _PartCollector()
+    parser = multipart.MultipartParser(boundary, collector.callbacks())
+
+    async for chunk in request.stream():
+        parser.write(chunk)
+        while collector.events:
+            yield collector.events.pop(0)
+
+    parser.finalize()
+    while collector.events:
+        yield collector.events.pop(0)
@@ -17,6 +17,13 @@ from reportlab.lib.units import inch
 import io
 import fitz
 from PIL import Image
+import hashlib
+from functools import lru_cache
+import numpy as np
+from backend.render_cache import RenderCache, render_cache
+from backend.profiling import stage as profile_stage
+import logging
+logger = logging.getLogger("uvicorn.error")
 
 def get_indian_datetime():
     # returns formatted date/time with AM/PM
@@ -68,17 +75,42 @@ def _find_phrase_bbox_from_words(page, phrase: str) -> Tuple[float,float,float,f
 
     raise ValueError("phrase not found")
 
-def remove_pdf_whitespace(doc: fitz.Document, dpi: int = 90, jpeg_quality: int = 60):
+def _content_bbox_from_pixels(page: fitz.Page, dpi: int = 24, threshold: int = 245) -> Optional[fitz.Rect]:
     """
-    Crop page → Render cropped region → convert to JPEG → embed → extremely small PDF output.
+    Bounding box of the non-white content of a page, from a low-dpi grayscale
+    thumbnail reduced with NumPy (any pixel darker than `threshold` is ink).
+    Returns None for a blank page. The rect is padded by one thumbnail pixel
+    and, like the thumbnail, is in rotated (displayed) page coordinates,
+    which is what get_pixmap(clip=...) expects.
     """
     scale = dpi / 72
-    out = fitz.open()
+    pix = page.get_pixmap(matrix=fitz.Matrix(scale, scale), colorspace=fitz.csGRAY, alpha=False)
+    pixels = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.stride)[:, :pix.width]
 
-    for pno in range(len(doc)):
-        page = doc[pno]
+    ink = pixels < threshold
+    rows = np.flatnonzero(ink.any(axis=1))
+    if rows.size == 0:
+        return None
+    cols = np.flatnonzero(ink.any(axis=0))
 
-        # find bounding box
+    rect = fitz.Rect(
+        (cols[0] - 1) / scale,
+        (rows[0] - 1) / scale,
+        (cols[-1] + 2) / scale,
+        (rows[-1] + 2) / scale,
+    )
+    return rect
+
+
+def _label_clip(page: fitz.Page, margin: float = 4, unrotated: bool = False) -> fitz.Rect:
+    """
+    Label region of a page: the bbox of its words (or of its ink, for
+    scanned / image-only labels) plus `margin`, clamped to the page; the
+    whole page when nothing is found. With `unrotated`, the ink bbox (found
+    on the displayed page) is mapped back to unrotated page coordinates, as
+    show_pdf_page(clip=...) expects.
+    """
+    with profile_stage("crop_bbox", page.number):
         words = page.get_text("words")
         if words:
             x0 = min(w[0] for w in words)
@@ -87,45 +119,87 @@ def remove_pdf_whitespace(doc: fitz.Document, dpi: int = 90, jpeg_quality: int =
             y1 = max(w[3] for w in words)
             bbox = fitz.Rect(x0, y0, x1, y1)
         else:
-            blocks = page.get_text("dict").get("blocks", [])
-            rects = [fitz.Rect(b["bbox"]) for b in blocks if "bbox" in b]
-            bbox = (sum(rects, rects[0]) if rects else page.rect)
-
-        # add margin + clamp to page
-        margin = 4
-        clip = fitz.Rect(
-            bbox.x0 - margin,
-            bbox.y0 - margin,
-            bbox.x1 + margin,
-            bbox.y1 + margin
-        )
-        clip &= page.rect
-
-        if clip.width <= 0 or clip.height <= 0:
-            clip = page.rect
-
-        # Render cropped area
-        mat = fitz.Matrix(scale, scale)
-        pix = page.get_pixmap(matrix=mat, clip=clip, alpha=False)
-
-        # Convert pixmap → PIL image
-        mode = "RGB" if pix.n < 4 else "RGBA"
-        img = Image.frombytes(mode, [pix.width, pix.height], pix.samples)
-
-        # Convert to grayscale (optional but reduces size heavily)
-        img = img.convert("L")
-
-        # Save JPEG with compression
-        img_bytes = io.BytesIO()
-        img.save(img_bytes, format="JPEG", quality=jpeg_quality, optimize=True)
-        img_bytes.seek(0)
+            # scanned / image-only label: find the ink from a thumbnail
+            bbox = _content_bbox_from_pixels(page) or page.rect
+            if unrotated:
+                bbox = bbox * page.derotation_matrix
+
+    # add margin + clamp to page
+    clip = fitz.Rect(
+        bbox.x0 - margin,
+        bbox.y0 - margin,
+        bbox.x1 + margin,
+        bbox.y1 + margin
+    )
+    page_rect = page.cropbox if unrotated else page.rect
+    clip &= page_rect
+
+    if clip.width <= 0 or clip.height <= 0:
+        clip = page_rect
+    return clip
+
+
+def remove_pdf_whitespace(doc: fitz.Document, dpi: int = 90, jpeg_quality: int = 60,
+                          cache: Optional[RenderCache] = render_cache):
+    """
+    Crop page → Render cropped region → convert to JPEG → embed → extremely small PDF output.
+    Encoded images are looked up in / stored to `cache` (pass None to disable).
+    """
+    scale = dpi / 72
+    mat = fitz.Matrix(scale, scale)
+    out = fitz.open()
+    img_bytes = io.BytesIO()  # reused JPEG buffer for every page
+    hash_memo: Dict[int, str] = {}  # shared fonts / images are hashed once per document
+
+    for pno in range(len(doc)):
+        page = doc[pno]
+
+        clip = _label_clip(page)
+
+        cache_key = None
+        jpeg_bytes = None
+        if cache is not None:
+            with profile_stage("crop_cache_lookup", pno):
+                try:
+                    cache_key = cache.make_key(_page_content_hash(page, hash_memo), clip, dpi, jpeg_quality)
+                except Exception as e:
+                    # unhashable page: render it without the cache
+                    logger.warning(f"Page {pno} not cacheable: {e}")
+                else:
+                    jpeg_bytes = cache.get(cache_key)
+
+        if jpeg_bytes is None:
+            # Render cropped area straight to grayscale (1 byte/pixel, no RGB→L pass).
+            # MuPDF's gray conversion is not PIL's RGB→L: colored fills and
+            # text come out up to ~50 levels different (black/white unchanged).
+            with profile_stage("crop_get_pixmap", pno):
+                pix = page.get_pixmap(matrix=mat, clip=clip, colorspace=fitz.csGRAY, alpha=False)
+
+            # Wrap the pixmap buffer without copying it
+            img = Image.frombuffer("L", (pix.width, pix.height), pix.samples_mv, "raw", "L", pix.stride, 1)
+
+            # Save JPEG with compression
+            with profile_stage("crop_jpeg_encode", pno):
+                img_bytes.seek(0)
+                img_bytes.truncate()
+                img.save(img_bytes, format="JPEG", quality=jpeg_quality, optimize=True)
+                jpeg_bytes = img_bytes.getvalue()
+
+            # release the view before the pixmap goes away
+            img.close()
+            del img
+            pix = None
+
+            if cache_key is not None:
+                cache.put(cache_key, jpeg_bytes)
 
         # Create new PDF page
-        new_page = out.new_page(width=clip.width, height=clip.height)
-        new_page.insert_image(
-            fitz.Rect(0, 0, clip.width, clip.height),
-            stream=img_bytes.getvalue()
-        )
+        with profile_stage("crop_insert_image", pno):
+            new_page = out.new_page(width=clip.width, height=clip.height)
+            new_page.insert_image(
+                fitz.Rect(0, 0, clip.width, clip.height),
+                stream=jpeg_bytes
+            )
 
     return out
 
@@ -144,73 +218,86 @@ def print_datetime_exactly_right_of_product_details(
     vertically aligned on the same baseline, for each page in the given doc.
     """
     for page in doc:
-        now = get_indian_datetime()  # Assuming you have this function to get current time
+        with profile_stage("stamp_datetime", page.number):
+            now = get_indian_datetime()  # Assuming you have this function to get current time
         
-        try:
-            # Find the bounding box of the phrase
-            x0, y0, x1, y1 = _find_phrase_bbox_from_words(page, phrase)
+            try:
+                # Find the bounding box of the phrase
+                x0, y0, x1, y1 = _find_phrase_bbox_from_words(page, phrase)
             
-            # Place timestamp right after the phrase ends
-            tx = x1 + x_gap
-            # Align vertically to the same baseline as the phrase
-            ty = y0 + y_shift
+                # Place timestamp right after the phrase ends
+                tx = x1 + x_gap
+                # Align vertically to the same baseline as the phrase
+                ty = y0 + y_shift
             
-            try:
-                # Insert the timestamp at the calculated position
-                page.insert_text((tx, ty), now, fontsize=fontsize, fontname=fontname)
-            except Exception as e:
-                page.insert_text((tx, ty), now, fontsize=fontsize)  # Fallback without fontname
-
-        except ValueError:
-            # Fallback: phrase not found, place at top-right corner
-            w, h = page.rect.width, page.rect.height
-            page.insert_text((w - 150, 40), now, fontsize=fontsize)
+                try:
+                    # Insert the timestamp at the calculated position
+                    page.insert_text((tx, ty), now, fontsize=fontsize, fontname=fontname)
+                except Exception as e:
+                    page.insert_text((tx, ty), now, fontsize=fontsize)  # Fallback without fontname
+
+            except ValueError:
+                # Fallback: phrase not found, place at top-right corner
+                w, h = page.rect.width, page.rect.height
+                page.insert_text((w - 150, 40), now, fontsize=fontsize)
          
 
-def sort_courier(original):
-        try:
-            page_meta = []
-            for pno in range(len(original)):
-                text = original[pno].get_text("text") or ""
-                courier = _detect_courier(text) or "__unknown__"
-                qty = _extract_quantity(text)
-                page_meta.append((pno, courier, qty))
-
-            # Count pages per courier
-            courier_counts = {}
-            first_appearance = {}
-
-            for pno, courier, _ in page_meta:
-                courier_counts[courier] = courier_counts.get(courier, 0) + 1
-                if courier not in first_appearance:
-                    first_appearance[courier] = pno
-
-            # Sorting rule
-            couriers_sorted = sorted(
-                courier_counts.keys(),
-                key=lambda c: (-courier_counts[c], first_appearance[c])
-            )
+def courier_sort_order(page_meta: List[Tuple[int, str, Optional[int]]]) -> List[int]:
+    """
+    Page order for "sort courier wise" from (pno, courier, qty) tuples:
+    biggest courier group first (first appearance breaks ties), unknown
+    courier last, and inside a group ascending qty with unknown qty last.
+    """
+    # One pass: bucket pages per courier (dict keeps first-appearance order)
+    groups: Dict[str, List[Tuple[Optional[int], int]]] = {}
+    for pno, courier, qty in page_meta:
+        groups.setdefault(courier, []).append((qty, pno))
+
+    # Sorting rule: biggest group first, first appearance breaks ties,
+    # unknown always last
+    couriers_sorted = sorted(
+        groups,
+        key=lambda c: (c == "__unknown__", -len(groups[c]), groups[c][0][1])
+    )
+
+    # Inside a group: ascending qty, unknown qty last, page order breaks ties
+    final_order = []
+    for courier in couriers_sorted:
+        pages = groups[courier]
+        pages.sort(key=lambda t: (t[0] is None, t[0] if isinstance(t[0], int) else 0, t[1]))
+        final_order.extend(pno for _, pno in pages)
 
-            # Move unknown last
-            if "__unknown__" in couriers_sorted:
-                couriers_sorted.remove("__unknown__")
-                couriers_sorted.append("__unknown__")
-
-            # Build final sorted order
-            final_order = []
-            for courier in couriers_sorted:
-                pages = [(pno, qty) for (pno, c, qty) in page_meta if c == courier]
-                pages.sort(key=lambda t: (
-                    1 if t[1] is None else 0,
-                    t[1] if isinstance(t[1], int) else 0,
-                    t[0]
-                ))
-                final_order.extend([p for p, _ in pages])
+    return final_order
+
+
+def sort_courier(original, final_order=None):
+        """
+        Courier/qty sorted copy of `original`. A precomputed `final_order`
+        (e.g. from the page index) skips the text extraction and the sort.
+        """
+        try:
+            if final_order is not None and sorted(final_order) != list(range(len(original))):
+                logger.warning("Cached page order does not match document, re-sorting")
+                final_order = None
+
+            if final_order is None:
+                page_meta = []
+                for pno in range(len(original)):
+                    with profile_stage("sort_get_text", pno):
+                        text = original[pno].get_text("text") or ""
+                    with profile_stage("sort_detect_courier", pno):
+                        courier = _detect_courier(text) or "__unknown__"
+                    with profile_stage("sort_extract_quantity", pno):
+                        qty = _extract_quantity(text)
+                    page_meta.append((pno, courier, qty))
+
+                final_order = courier_sort_order(page_meta)
 
             # Create sorted PDF
             sorted_doc = fitz.open()
             for pno in final_order:
-                sorted_doc.insert_pdf(original, from_page=pno, to_page=pno)
+                with profile_stage("sort_insert_pdf", pno):
+                    sorted_doc.insert_pdf(original, from_page=pno, to_page=pno)
 
             working_doc = sorted_doc
             return working_doc
@@ -243,43 +330,10 @@ def extract_meesho_data(pdf_input) -> List[Dict]:
     
     for page_num in range(len(doc)):
         page = doc[page_num]
-        text = page.get_text()
-
-        record = {}
-        lines = [l for l in text.splitlines() if l.strip()]
-        product_details = {}
-        for i , line in enumerate(lines):
-            if line.lower() == "product details":
-                try:
-                    sku     = lines[i+6]
-                    size    = lines[i+7]
-                    qty     = lines[i+8]
-                    color   = lines[i+9]
-                    orderno = lines[i+10]
-                    product_details.update({'SKU':sku ,'Size':size,'QTY':qty,'Color':color,'Order No':orderno})
-                except:
-                    return None
-        
-        record['SKU'] = product_details.get('SKU','Unknown').strip()
-        record['Size'] = product_details.get('Size','Free Size').strip()
-        record['QTY'] = int(product_details.get('QTY',1))
-        record['Color'] = product_details.get('Color','Unknown').strip()
-        record['Order No'] = product_details.get('Order No','Unknown').strip() 
-
-
-        # Extract Courier Partner from shipping section
-        couriers = ['Delhivery', 'Shadowfax', 'Valmo', 'Xpress Bees', 'Bluedart', 'Ecom', 'DTDC', 'Ekart']
-        record['Courier'] = 'Unknown'
-        text_upper = text.upper()
-        for courier in couriers:
-            if courier.upper() in text_upper:
-                record['Courier'] = courier
-                break
-        
-        seller_pattern = r"Sold\s+by\s*:\s*(.+)"
-        seller_name = re.search(seller_pattern, text, re.IGNORECASE)
-        
-        record['Seller'] = seller_name.group(1).strip() if seller_name else 'Unknown'
+        with profile_stage("summary_extract", page_num):
+            record = extract_meesho_record(page.get_text())
+        if record is None:
+            return None
         extracted_data.append(record)
     
     if should_close:
@@ -288,6 +342,49 @@ def extract_meesho_data(pdf_input) -> List[Dict]:
     return extracted_data
 
 
+def extract_meesho_record(text: str) -> Optional[Dict]:
+    """
+    Summary fields of one label page from its extracted text.
+    Returns None when the Product Details table is cut short.
+    """
+    record = {}
+    lines = [l for l in text.splitlines() if l.strip()]
+    product_details = {}
+    for i , line in enumerate(lines):
+        if line.lower() == "product details":
+            try:
+                sku     = lines[i+6]
+                size    = lines[i+7]
+                qty     = lines[i+8]
+                color   = lines[i+9]
+                orderno = lines[i+10]
+                product_details.update({'SKU':sku ,'Size':size,'QTY':qty,'Color':color,'Order No':orderno})
+            except:
+                return None
+    
+    record['SKU'] = product_details.get('SKU','Unknown').strip()
+    record['Size'] = product_details.get('Size','Free Size').strip()
+    record['QTY'] = int(product_details.get('QTY',1))
+    record['Color'] = product_details.get('Color','Unknown').strip()
+    record['Order No'] = product_details.get('Order No','Unknown').strip() 
+
+
+    # Extract Courier Partner from shipping section
+    couriers = ['Delhivery', 'Shadowfax', 'Valmo', 'Xpress Bees', 'Bluedart', 'Ecom', 'DTDC', 'Ekart']
+    record['Courier'] = 'Unknown'
+    text_upper = text.upper()
+    for courier in couriers:
+        if courier.upper() in text_upper:
+            record['Courier'] = courier
+            break
+    
+    seller_pattern = r"Sold\s+by\s*:\s*(.+)"
+    seller_name = re.search(seller_pattern, text, re.IGNORECASE)
+    
+    record['Seller'] = seller_name.group(1).strip() if seller_name else 'Unknown'
+    return record
+
+
 def create_order_summary(data: List[Dict]) -> pd.DataFrame:
     """
     Create ORDER SUMMARY TABLE
@@ -333,6 +430,12 @@ def create_company_summary(data: List[Dict]) -> pd.DataFrame:
     return company_summary
 
 
+@lru_cache(maxsize=1)
+def report_styles():
+    """reportlab sample stylesheet, built once per process."""
+    return getSampleStyleSheet()
+
+
 def create_pdf_report(order_summary: pd.DataFrame, 
                       courier_summary: pd.DataFrame, 
                       company_summary: pd.DataFrame,
@@ -357,7 +460,7 @@ def create_pdf_report(order_summary: pd.DataFrame,
     elements = []
     
     # Styles
-    styles = getSampleStyleSheet()
+    styles = report_styles()
     title_style = styles['Heading1']
     heading_style = styles['Heading2']
     
@@ -530,17 +633,9 @@ def _extract_quantity(text: str) -> Optional[int]:
     block = "\n".join(cleaned)
 
     # --- 2) First, try your original Qty pattern (Qty: 1, Qty 1 etc.) ---
-    qty_keyword_patterns = [
-        re.compile(
-            r"\bQty\b(?:\s*|\s*[:\-]\s*|\s*\n\s*)([0-9]{1,6})\b",
-            flags=re.IGNORECASE,
-        )
-    ]
-
-    for rx in qty_keyword_patterns:
-        m = rx.search(block)
-        if m:
-            return int(m.group(1))
+    m = _QTY_PATTERNS[0].search(block)
+    if m:
+        return int(m.group(1))
 
     # --- 3) Table-based Qty extraction ---
     # Detect header line containing SKU | Size | Qty | Color
@@ -568,8 +663,7 @@ def _extract_quantity(text: str) -> Optional[int]:
 
     # --- 4) Fallback: generic pattern, matches lines like:
     # "something  something  3  something"
-    fallback_rx = re.compile(r"(?mi)^.+?\s+.+?\s+([0-9]{1,6})\s+.+?$")
-    m = fallback_rx.search(block)
+    m = _QTY_PATTERNS[1].search(block)
     if m:
         try:
             return int(m.group(1))
@@ -597,54 +691,13 @@ def sort_doc_by_courier_and_quantity_fixed(doc: fitz.Document, debug: bool = Fal
         if debug:
             print(f"[page {pno}] courier={courier}, qty={qty}, snippet={snippet!r}")
 
-    # 2. Count pages per courier
-    courier_counts: Dict[str, int] = {}
-    for _, courier, _, _ in page_meta:
-        courier_counts[courier] = courier_counts.get(courier, 0) + 1
-
-    # 3. First appearance (tie-breaker)
-    first_appearance: Dict[str, int] = {}
-    for pno, courier, _, _ in page_meta:
-        if courier not in first_appearance:
-            first_appearance[courier] = pno
-
-    # 4. Sort courier groups
-    couriers_sorted = sorted(
-        courier_counts.keys(),
-        key=lambda c: (-courier_counts[c], first_appearance.get(c, 10**9))
-    )
-
-    # Move unknown to last
-    if "__unknown__" in couriers_sorted:
-        couriers_sorted = [c for c in couriers_sorted if c != "__unknown__"] + ["__unknown__"]
-
-    if debug:
-        print("\nCourier Order:")
-        for c in couriers_sorted:
-            print(f"  {c}: count={courier_counts[c]}, first_at={first_appearance[c]}")
-
-    # 5. Sort pages inside each courier group by Qty
-    final_order = []
-    for courier in couriers_sorted:
-        pages = [(pno, qty) for (pno, c, qty, _) in page_meta if c == courier]
-
-        # FIXED SORT: None goes last, quantities ascend
-        pages.sort(
-            key=lambda t: (
-                1 if t[1] is None else 0,
-                t[1] if isinstance(t[1], int) else 999999
-            )
-        )
-
-        if debug:
-            print(f"\nCourier {courier} sorted pages (pno, qty): {pages}")
-
-        final_order.extend([p for p, _ in pages])
+    # 2. Courier groups by size, then qty inside each group
+    final_order = courier_sort_order([(pno, courier, qty) for pno, courier, qty, _ in page_meta])
 
     if debug:
         print("\nFinal page order:", final_order)
 
-    # 6. Build output document
+    # 3. Build output document
     out = fitz.open()
     for pno in final_order:
         out.insert_pdf(doc, from_page=pno, to_page=pno)
@@ -701,3 +754,291 @@ def build_clean_doc(src_doc: fitz.Document, pages_to_remove: list):
         if i not in pages_to_remove_set:
             new_doc.insert_pdf(src_doc, from_page=i, to_page=i)
     return new_doc
+
+
+# -----------------------------------------------------
+#  PAGE DEDUPLICATION
+# -----------------------------------------------------
+_ORDER_NO_RX = re.compile(r"(?i)\border\s*no\.?\s*[:\-]?\s*([A-Za-z0-9_\-]{4,})")
+
+
+def _extract_order_number(text: str) -> Optional[str]:
+    """
+    Order number of a label page. Uses the same "Product Details" table layout
+    as extract_meesho_data, falls back to an inline "Order No: XXX" match.
+    """
+    if not text:
+        return None
+
+    lines = [l.strip() for l in text.splitlines() if l.strip()]
+    for i, line in enumerate(lines):
+        if line.lower() == "product details" and i + 10 < len(lines):
+            return lines[i + 10]
+
+    m = _ORDER_NO_RX.search(text)
+    return m.group(1) if m else None
+
+
+# back references (page tree parent, annotation page) that would otherwise
+# pull the whole document into a page hash
+_BACKREF_KEYS = {"/Parent", "/P"}
+_PDF_DELIMS = set("()<>[]{}/%") | set(" \t\r\n\f\0")
+
+# stream encoding keys, left out when the decoded stream is hashed
+_STREAM_ENCODING_KEYS = {"/Filter", "/DecodeParms", "/Length", "/DL"}
+
+
+def _canonical_pdf_object(text: str, ref, skip_keys=_BACKREF_KEYS) -> str:
+    """
+    Canonical form of a PDF object source (as from xref_object): dictionary
+    keys sorted, `skip_keys` (back references) dropped and every "N 0 R" replaced by
+    ref(N). Two copies of the same object in different files, where
+    insert_pdf renumbers objects and reorders keys, come out identical.
+    """
+    pos = 0
+    n = len(text)
+
+    def skip_ws():
+        nonlocal pos
+        while pos < n and text[pos] in " \t\r\n\f\0":
+            pos += 1
+
+    def token():
+        nonlocal pos
+        start = pos
+        while pos < n and text[pos] not in _PDF_DELIMS:
+            pos += 1
+        return text[start:pos]
+
+    def value():
+        nonlocal pos
+        skip_ws()
+        c = text[pos]
+        if text.startswith("<<", pos):
+            pos += 2
+            items = []
+            while True:
+                skip_ws()
+                if text.startswith(">>", pos):
+                    pos += 2
+                    break
+                pos += 1  # "/"
+                key = "/" + token()
+                items.append((key, value()))
+            return "<<" + "".join(f"{k} {v}" for k, v in sorted(items) if k not in skip_keys) + ">>"
+        if c == "[":
+            pos += 1
+            items = []
+            while True:
+                skip_ws()
+                if text[pos] == "]":
+                    pos += 1
+                    break
+                items.append(value())
+            return "[" + " ".join(items) + "]"
+        if c == "(":
+            start, depth = pos, 0
+            while True:
+                c = text[pos]
+                if c == "\\":
+                    pos += 2
+                    continue
+                pos += 1
+                if c == "(":
+                    depth += 1
+                elif c == ")":
+                    depth -= 1
+                    if depth == 0:
+                        return text[start:pos]
+        if c == "<":
+            end = text.index(">", pos) + 1
+            literal, pos = text[pos:end], end
+            return literal
+        if c == "/":
+            pos += 1
+            return "/" + token()
+
+        atom = token()
+        # "N G R" is an indirect reference
+        save = pos
+        skip_ws()
+        generation = token()
+        skip_ws()
+        if generation.isdigit() and atom.isdigit() and text.startswith("R", pos) and (
+            pos + 1 == n or text[pos + 1] in _PDF_DELIMS
+        ):
+            pos += 1
+            return ref(int(atom))
+        pos = save
+        return atom
+
+    out = []
+    while True:
+        skip_ws()
+        if pos >= n:
+            return " ".join(out)
+        out.append(value())
+
+
+def _object_digest(doc: fitz.Document, xref: int, memo: Dict[int, str], active: set) -> str:
+    """
+    Merkle digest of an object and everything it references: its canonical
+    dictionary with every reference replaced by the digest of the referenced
+    object, plus its stream. Form XObjects, images, fonts (and their font
+    files), patterns, shadings, ExtGStates and annotations are all covered.
+
+    Streams other than images are hashed decoded, without their encoding
+    keys, so the same content stored with a different compression matches.
+    Image data is hashed as stored.
+    """
+    if xref in memo:
+        return memo[xref]
+    if xref in active:  # reference cycle
+        return "cycle"
+    if not 0 < xref < doc.xref_length():
+        return "null"  # dangling reference, a missing object is null
+    active.add(xref)
+
+    try:
+        source = doc.xref_object(xref, compressed=True)
+    except RuntimeError:
+        source = "null"
+
+    stream = None
+    skip_keys = _BACKREF_KEYS
+    if doc.xref_is_stream(xref):
+        if doc.xref_get_key(xref, "Subtype") == ("name", "/Image"):
+            stream = doc.xref_stream_raw(xref)
+        else:
+            stream = doc.xref_stream(xref)
+            skip_keys = _BACKREF_KEYS | _STREAM_ENCODING_KEYS
+
+    h = hashlib.sha1()
+    h.update(_canonical_pdf_object(
+        source, lambda x: _object_digest(doc, x, memo, active), skip_keys
+    ).encode())
+    if stream is not None:
+        h.update(stream)
+
+    active.discard(xref)
+    memo[xref] = h.hexdigest()
+    return memo[xref]
+
+
+def _inherited_resources(doc: fitz.Document, xref: int) -> str:
+    """/Resources of a page, following the page tree when it is inherited."""
+    while xref:
+        kind, value = doc.xref_get_key(xref, "Resources")
+        if kind != "null":
+            return value
+        kind, parent = doc.xref_get_key(xref, "Parent")
+        if kind != "xref":
+            break
+        xref = int(parent.split()[0])
+    return ""
+
+
+def _page_content_hash(page: fitz.Page, memo: Optional[Dict[int, str]] = None) -> str:
+    """
+    Hash of everything that decides how a page looks: its geometry and the
+    complete object tree under the page (content streams, resources
+    recursively including form XObjects and font files, annotations).
+    Object numbers are not part of the hash, so identical pages copied from
+    different uploads get the same hash.
+
+    `memo` (xref -> digest) can be shared across the pages of one unchanged
+    document, so shared fonts and images are hashed once.
+    """
+    doc = page.parent
+    memo = {} if memo is None else memo
+    active = set()
+
+    def canonical(text):
+        return _canonical_pdf_object(text, lambda x: _object_digest(doc, x, memo, active))
+
+    h = hashlib.sha1()
+    h.update(f"{tuple(page.rect)}|{page.rotation}".encode())
+    h.update(canonical(doc.xref_object(page.xref, compressed=True)).encode())
+    if doc.xref_get_key(page.xref, "Resources")[0] == "null":
+        h.update(canonical(_inherited_resources(doc, page.xref)).encode())
+    return h.hexdigest()
+
+
+def dedupe_pages(doc: fitz.Document) -> Tuple[fitz.Document, List[Dict]]:
+    """
+    Drop exact duplicate pages, fingerprinted by order number + content hash.
+    Keeps the first occurrence. Returns (deduped_doc, removed) where removed
+    is a list of {"page", "order_no", "duplicate_of"} for every dropped page.
+    If nothing was removed the original doc is returned unchanged.
+    """
+    seen: Dict[Tuple[Optional[str], str], int] = {}
+    keep: List[int] = []
+    removed: List[Dict] = []
+
+    memo: Dict[int, str] = {}
+    for pno in range(len(doc)):
+        page = doc[pno]
+        order_no = _extract_order_number(page.get_text("text") or "")
+        # the hash covers the whole object tree, so pages without an order
+        # number only match when their content is identical
+        try:
+            key = (order_no, _page_content_hash(page, memo))
+        except Exception as e:
+            logger.warning(f"Page {pno} not hashable, keeping it: {e}")
+            keep.append(pno)
+            continue
+
+        if key in seen:
+            removed.append({"page": pno, "order_no": order_no, "duplicate_of": seen[key]})
+        else:
+            seen[key] = pno
+            keep.append(pno)
+
+    if not removed:
+        return doc, removed
+
+    out = fitz.open()
+    for pno in keep:
+        out.insert_pdf(doc, from_page=pno, to_page=pno)
+    return out, removed
+
+
+# -----------------------------------------------------
+#  MULTI-UP IMPOSITION
+# -----------------------------------------------------
+# labels per sheet -> (columns, rows) on a portrait A4 sheet
+IMPOSITION_GRIDS = {
+    1: (1, 1),
+    2: (1, 2),
+    4: (2, 2),
+}
+
+
+def impose_labels(doc: fitz.Document, per_sheet: int = 4, margin: float = 18, gap: float = 12,
+                  crop: bool = False) -> fitz.Document:
+    """
+    Pack the pages of `doc` in order into a grid on A4 sheets.
+    Pages are placed with show_pdf_page (vector, no re-rasterization),
+    scaled to fit their cell with the aspect ratio kept. With `crop` (pages
+    not already cropped by remove_pdf_whitespace) only the label region of
+    each page is shown.
+    """
+    cols, rows = IMPOSITION_GRIDS[per_sheet]
+    sheet_w, sheet_h = fitz.paper_size("a4")
+    cell_w = (sheet_w - 2 * margin - (cols - 1) * gap) / cols
+    cell_h = (sheet_h - 2 * margin - (rows - 1) * gap) / rows
+
+    out = fitz.open()
+    sheet = None
+    for pno in range(len(doc)):
+        slot = pno % per_sheet
+        if slot == 0:
+            sheet = out.new_page(width=sheet_w, height=sheet_h)
+
+        row, col = divmod(slot, cols)
+        x0 = margin + col * (cell_w + gap)
+        y0 = margin + row * (cell_h + gap)
+        clip = _label_clip(doc[pno], unrotated=True) if crop else None
+        sheet.show_pdf_page(fitz.Rect(x0, y0, x0 + cell_w, y0 + cell_h), doc, pno, clip=clip)
+
+    return out
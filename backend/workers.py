@@ -0,0 +1,85 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+import fitz
+from starlette.concurrency import run_in_threadpool
+
+from backend.pdf_process import process_pdf
+import logging
+logger = logging.getLogger("uvicorn.error")
+
+
+# Number of long-lived processing processes. 0 keeps the old model: jobs run
+# in the web worker's threadpool.
+WORKERS = int(os.getenv("CROP_PDF_WORKERS", "0"))
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+# every filter that has one-time setup: fonts, regexes, pandas, reportlab
+WARMUP_FILTER = {
+    "remove_white": True,
+    "print_datetime": True,
+    "sort_courier": True,
+    "bottom_of_the_table": True,
+    "remove_duplicates": True,
+}
+
+
+def warm_worker():
+    """
+    Pool initializer: pay the one-time setup in each worker process before it
+    takes jobs, by running a one-label document through every filter —
+    MuPDF fonts (Times-Roman stamp) and rendering, the courier / qty regexes,
+    pandas grouping, and the reportlab styles and Helvetica metrics.
+    """
+    doc = fitz.open()
+    page = doc.new_page(width=300, height=300)
+    lines = ["Delhivery", "Product Details", "SKU", "Size", "Qty", "Color", "Order No.",
+             "A", "M", "1", "Red", "WARMUP", "Sold by : Store"]
+    for i, line in enumerate(lines):
+        page.insert_text((10, 20 + 14 * i), line, fontsize=10)
+
+    process_pdf(doc.tobytes(), WARMUP_FILTER).tobytes()
+
+
+def _ping():
+    return os.getpid()
+
+
+def start_pool(workers: int = WORKERS) -> Optional[ProcessPoolExecutor]:
+    """Start `workers` warmed-up processes (no-op when workers <= 0)."""
+    global _pool
+    if workers <= 0 or _pool is not None:
+        return _pool
+
+    _pool = ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=warm_worker,
+    )
+    # wait until every process is up and warm, so the first request does not pay for it
+    pids = {f.result() for f in [_pool.submit(_ping) for _ in range(workers)]}
+    logger.info(f"Processing pool ready: {len(pids)} workers")
+    return _pool
+
+
+def stop_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=True, cancel_futures=True)
+        _pool = None
+
+
+async def run_job(fn, *args):
+    """
+    Run a picklable job function on the processing pool, or in the threadpool
+    when no pool is running.
+    """
+    if _pool is None:
+        return await run_in_threadpool(fn, *args)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_pool, fn, *args)
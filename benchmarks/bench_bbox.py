@@ -0,0 +1,108 @@
+"""
+Content bbox benchmark: text based bbox (words / dict blocks, the old
+fallback) vs the pixel based thumbnail bbox, on text labels and on the same
+labels as image-only (scanned) pages.
+
+    python -m benchmarks.bench_bbox [labels.pdf]
+
+Without an argument a synthetic 100 page label PDF is used.
+"""
+import sys
+import time
+
+import fitz
+
+from backend.utils import _content_bbox_from_pixels, remove_pdf_whitespace
+
+
+def synthetic_labels(pages: int = 100) -> fitz.Document:
+    doc = fitz.open()
+    for i in range(pages):
+        page = doc.new_page(width=595, height=842)
+        y = 60
+        for line in ["Customer Address", f"Name {i}", "Delhivery", "Product Details",
+                     "SKU", "Size", "Qty", "Color", "Order No.",
+                     f"SKU-{i % 5}", "M", "1", "Red", f"ORD{i:06d}", "Sold by : Store"]:
+            page.insert_text((60, y), line, fontsize=10)
+            y += 14
+        page.draw_rect(fitz.Rect(50, 40, 350, y), color=(0, 0, 0))
+    return doc
+
+
+def scanned_copy(doc: fitz.Document, dpi: int = 150) -> fitz.Document:
+    out = fitz.open()
+    for page in doc:
+        pix = page.get_pixmap(dpi=dpi)
+        new_page = out.new_page(width=page.rect.width, height=page.rect.height)
+        new_page.insert_image(new_page.rect, stream=pix.tobytes("png"))
+    return out
+
+
+def text_bbox(page: fitz.Page) -> fitz.Rect:
+    words = page.get_text("words")
+    if words:
+        return fitz.Rect(min(w[0] for w in words), min(w[1] for w in words),
+                         max(w[2] for w in words), max(w[3] for w in words))
+    # same expression as the old remove_pdf_whitespace fallback, clamped like its clip
+    blocks = page.get_text("dict").get("blocks", [])
+    rects = [fitz.Rect(b["bbox"]) for b in blocks if "bbox" in b]
+    return (sum(rects, rects[0]) if rects else page.rect) & page.rect
+
+
+def ink_pixels(page: fitz.Page) -> int:
+    pix = page.get_pixmap(dpi=72, colorspace=fitz.csGRAY)
+    return sum(1 for v in pix.samples if v < 128)
+
+
+def check_rotated(doc: fitz.Document):
+    """
+    remove_pdf_whitespace on an image-only page at every /Rotate must keep
+    the ink: the pixel bbox and the clip are both in displayed coordinates.
+    """
+    png = doc[0].get_pixmap(dpi=100).tobytes("png")
+    for rotation in (0, 90, 180, 270):
+        scan = fitz.open()
+        page = scan.new_page(width=doc[0].rect.width, height=doc[0].rect.height)
+        page.insert_image(page.rect, stream=png)
+        page.set_rotation(rotation)
+        before = ink_pixels(scan[0])
+        after = ink_pixels(remove_pdf_whitespace(scan, cache=None)[0])
+        print(f"  rotate {rotation:3d}: ink {before} -> {after} pixels")
+        # JPEG + resampling thin text loses some ink, a misplaced clip loses all of it
+        assert after >= 0.5 * before, f"crop lost the label at rotation {rotation}"
+
+
+def timed(fn, doc):
+    start = time.perf_counter()
+    result = [fn(page) for page in doc]
+    return time.perf_counter() - start, result
+
+
+def area_ratio(rects, doc):
+    covered = sum(abs(r) for r in rects if r is not None)
+    return covered / sum(abs(p.rect) for p in doc)
+
+
+def main():
+    doc = fitz.open(sys.argv[1]) if len(sys.argv) > 1 else synthetic_labels()
+    scanned = scanned_copy(doc)
+
+    for name, d in (("text labels", doc), ("scanned labels", scanned)):
+        t_text, r_text = timed(text_bbox, d)
+        t_pix, r_pix = timed(_content_bbox_from_pixels, d)
+        print(f"{name} ({len(d)} pages)")
+        print(f"  text bbox : {t_text * 1000:8.1f} ms  area {area_ratio(r_text, d):.0%} of page")
+        print(f"  pixel bbox: {t_pix * 1000:8.1f} ms  area {area_ratio(r_pix, d):.0%} of page")
+
+    start = time.perf_counter()
+    out = remove_pdf_whitespace(scanned, cache=None)
+    elapsed = time.perf_counter() - start
+    print(f"remove_pdf_whitespace on scanned labels: {elapsed * 1000:.1f} ms, "
+          f"{len(out.tobytes()) / 1024:.0f} KB output")
+
+    print("rotated scanned labels")
+    check_rotated(doc)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+First-request and steady-state latency of the processing models:
+
+  threadpool  jobs run in the web worker (CROP_PDF_WORKERS=0), every fresh
+              worker pays fonts / reportlab / MuPDF setup on its first request
+  pool        warmed-up processing processes (CROP_PDF_WORKERS=N)
+
+    python -m benchmarks.bench_workers [labels.pdf]
+
+The on-disk render cache and page index are turned off for both models:
+they are shared between runs, so whichever runs second would mostly time
+cache hits.
+"""
+import json
+import os
+import subprocess
+import sys
+import time
+
+# before anything imports backend; the threadpool subprocess and the
+# spawned pool processes inherit it
+os.environ["RENDER_CACHE_MAX_MB"] = "0"
+os.environ["PAGE_INDEX_CACHE_SIZE"] = "0"
+
+from benchmarks.bench_bbox import synthetic_labels
+
+FILTER = {
+    "remove_white": True,
+    "print_datetime": True,
+    "sort_courier": True,
+    "bottom_of_the_table": True,
+}
+STEADY_RUNS = 5
+
+# runs in a fresh interpreter, like a freshly (re)started web worker
+THREADPOOL_SCRIPT = """
+import json, sys, time
+t0 = time.perf_counter()
+from backend.jobs import run_crop_job
+t1 = time.perf_counter()
+data = open(sys.argv[1], "rb").read()
+job = [{"bytes": data, "filename": "labels.pdf"}]
+flt = json.loads(sys.argv[2])
+times = []
+for _ in range(int(sys.argv[3]) + 1):
+    start = time.perf_counter()
+    run_crop_job(job, False, "", flt)
+    times.append(time.perf_counter() - start)
+print(json.dumps({"startup": t1 - t0, "times": times}))
+"""
+
+
+def bench_threadpool(path):
+    out = subprocess.run(
+        [sys.executable, "-c", THREADPOOL_SCRIPT, path, json.dumps(FILTER), str(STEADY_RUNS)],
+        capture_output=True, text=True, check=True,
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def bench_pool(path):
+    from backend.jobs import run_crop_job
+    from backend import workers
+
+    t0 = time.perf_counter()
+    pool = workers.start_pool(1)
+    startup = time.perf_counter() - t0
+
+    data = open(path, "rb").read()
+    job = [{"bytes": data, "filename": "labels.pdf"}]
+    times = []
+    for _ in range(STEADY_RUNS + 1):
+        start = time.perf_counter()
+        pool.submit(run_crop_job, job, False, "", FILTER).result()
+        times.append(time.perf_counter() - start)
+
+    workers.stop_pool()
+    return {"startup": startup, "times": times}
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else "/tmp/bench_workers_labels.pdf"
+    if len(sys.argv) == 1:
+        synthetic_labels(20).save(path)
+
+    for name, fn in (("threadpool", bench_threadpool), ("pool", bench_pool)):
+        result = fn(path)
+        first, steady = result["times"][0], result["times"][1:]
+        print(f"{name:10s} startup {result['startup'] * 1000:7.1f} ms   "
+              f"first request {first * 1000:7.1f} ms   "
+              f"steady {sum(steady) / len(steady) * 1000:7.1f} ms")
+
+
+if __name__ == "__main__":
+    main()